@@ -0,0 +1,208 @@
+#!/usr/bin/python3
+"""
+Benchmarks for diarydek, run against synthetic diaries.
+
+A seeded generator builds a diary of the requested size, with tags drawn
+from a skewed (Zipf-like) distribution, as in real diaries where a few tags
+are used far more than the rest.  Each operation is then timed, and the
+results are written as JSON, to standard output unless --output names a
+file; all else goes to standard error.  Given a baseline file from an
+earlier run, operations that have slowed by more than a threshold are
+reported, and the exit status is 1.
+
+    python3 benchmarks/bench.py --size 10000 --output new.json
+    python3 benchmarks/bench.py --size 10000 --baseline old.json --threshold 0.25
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import sqlite3
+import sys
+import tempfile
+from time import perf_counter as timer
+
+from diarydek.diarydek import Diarydek
+
+words = (
+    "the a of to and in met with call about review draft plan lunch walk "
+    "ran read wrote paper meeting student code bug fix release heron crow "
+    "garden rain snow coffee notes idea budget travel train seminar email"
+).split()
+
+
+def generate(n, seed=1, ntags=200):
+    """
+    Yield n (time, entry, tags) rows, in time order, for a synthetic diary.
+    The same seed always gives the same rows.
+    """
+    rng = random.Random(seed)
+    tagNames = ["tag%03d" % i for i in range(ntags)]
+    # Zipf-like weights, so that tag000 is the most common
+    weights = [1.0 / (i + 1) for i in range(ntags)]
+    time = datetime.datetime(2000, 1, 1)
+    # spread entries over about 20 years
+    step = 20 * 365 * 86400 / max(n, 1)
+    for i in range(n):
+        time += datetime.timedelta(seconds=rng.expovariate(1.0 / step))
+        entry = " ".join(rng.choice(words) for _ in range(rng.randint(3, 20)))
+        ntag = min(rng.choice([0, 1, 1, 1, 2, 2, 3, 4]), ntags)
+        tags = []
+        while len(tags) < ntag:
+            tag = rng.choices(tagNames, weights)[0]
+            if tag not in tags:
+                tags.append(tag)
+        yield (str(time), entry, tags)
+
+
+def timed(results, name, f, repeat=3):
+    """Record in results[name] the shortest of 'repeat' timings of f()"""
+    best = None
+    for _ in range(repeat):
+        start = timer()
+        f()
+        elapsed = timer() - start
+        best = elapsed if best is None else min(best, elapsed)
+    results[name] = best
+    print("  %-20s %10.4fs" % (name, best), file=sys.stderr)
+
+
+def run(size, seed=1, repeat=3):
+    """Run all benchmarks on a diary of the given size, returning timings"""
+    results = {}
+    directory = tempfile.mkdtemp(prefix="diarydek-bench")
+    db = os.path.join(directory, "bench.db")
+    diary = Diarydek(db=db, quiet=True)
+    rows = list(generate(size, seed))
+    timed(results, "import_entries", lambda: diary.import_entries(rows), repeat=1)
+    counter = iter(range(10**9))
+
+    def add():
+        for _ in range(100):
+            diary.add_entry(
+                "2030-01-01 00:00:%02d" % (next(counter) % 60), "added entry", ["tag000", "new"]
+            )
+
+    timed(results, "add_entry (x100)", add, repeat=1)
+    timed(results, "list all", lambda: sum(1 for _ in diary.iter_entries()), repeat)
+    timed(
+        results,
+        "list by tag",
+        lambda: sum(1 for _ in diary.iter_entries(tag="tag005")),
+        repeat,
+    )
+    timed(
+        results,
+        "list by text",
+        lambda: sum(1 for _ in diary.iter_entries(text="heron")),
+        repeat,
+    )
+    timed(
+        results,
+        "list since",
+        lambda: sum(1 for _ in diary.iter_entries(since="2019-01-01")),
+        repeat,
+    )
+    with open(os.devnull, "w") as devnull:
+        timed(results, "write_csv", lambda: diary.write_csv(devnull), repeat)
+    timed(results, "showTags", diary.get_tags_with_counts, repeat)
+    names = iter(["renamed%d" % i for i in range(2 * repeat)])
+    current = ["tag001"]
+
+    def rename():
+        new = next(names)
+        diary.rename_tag(current[0], new)
+        current[0] = new
+
+    timed(results, "rename_tag", rename, repeat)
+    ids = iter(range(1, size + 1))
+    timed(results, "delete_by_id", lambda: diary.delete_by_id(next(ids)), repeat)
+    diary.con.close()
+    for name in os.listdir(directory):
+        os.remove(os.path.join(directory, name))
+    os.rmdir(directory)
+    return results
+
+
+def compare(results, baseline, threshold, thresholds={}):
+    """
+    Return a list of (name, old, new) for benchmarks that are slower than in
+    the baseline by more than the threshold, a fraction of the old time.
+    Items in 'thresholds' override this for individual benchmarks.
+    """
+    slower = []
+    for name, new in sorted(results.items()):
+        old = baseline.get(name)
+        if old is None:
+            continue
+        if new > old * (1 + thresholds.get(name, threshold)):
+            slower.append((name, old, new))
+    return slower
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time diarydek operations.")
+    parser.add_argument(
+        "--size",
+        type=int,
+        nargs="+",
+        default=[10000],
+        help="number of entries in the synthetic diary (e.g. 10000 100000 1000000)",
+    )
+    parser.add_argument("--seed", type=int, default=1, help="random seed")
+    parser.add_argument("--repeat", type=int, default=3, help="timings per benchmark")
+    parser.add_argument("--output", type=str, default=None, help="write JSON results here")
+    parser.add_argument("--baseline", type=str, default=None, help="JSON results to compare with")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.25,
+        help="fractional slowdown counted as a regression (default 0.25)",
+    )
+    parser.add_argument(
+        "--thresholdFor",
+        type=str,
+        nargs=2,
+        action="append",
+        default=[],
+        metavar=("name", "fraction"),
+        help="threshold for one benchmark, e.g. --thresholdFor 'add_entry (x100)' 0.5",
+    )
+    args = parser.parse_args()
+    report = {
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "seed": args.seed,
+        "sizes": {},
+    }
+    for size in args.size:
+        print("Diary with %d entries:" % size, file=sys.stderr)
+        report["sizes"][str(size)] = run(size, args.seed, args.repeat)
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        thresholds = dict((name, float(value)) for name, value in args.thresholdFor)
+        regressed = False
+        for size, results in report["sizes"].items():
+            old = baseline["sizes"].get(size, {})
+            for name, before, after in compare(results, old, args.threshold, thresholds):
+                regressed = True
+                print(
+                    "Regression for %s entries, %s: %.4fs -> %.4fs"
+                    % (size, name, before, after),
+                    file=sys.stderr,
+                )
+        sys.exit(1 if regressed else 0)
+
+
+if __name__ == "__main__":
+    main()
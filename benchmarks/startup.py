@@ -0,0 +1,112 @@
+#!/usr/bin/python3
+"""
+Start-up time budget for diarydek.
+
+Each command below is run with 'python -X importtime', and the time spent
+importing modules is compared with the budget in startup_budget.json.  The
+exit status is 1 if any command is over budget, or if it imports a module
+that its fast path should avoid.
+
+    python3 benchmarks/startup.py
+    python3 benchmarks/startup.py --update   # record current times as budget
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+here = os.path.dirname(os.path.abspath(__file__))
+budgetFile = os.path.join(here, "startup_budget.json")
+
+# modules that each fast path must not import
+forbidden = {
+    "version": ["argparse", "sqlite3", "csv", "textwrap", "datetime"],
+    "add": ["argparse", "csv", "textwrap"],
+    "complete": ["argparse", "sqlite3", "csv", "textwrap", "datetime"],
+}
+
+
+def import_times(args, env=None):
+    """
+    Run 'python -X importtime -m diarydek' with the given arguments, and
+    environment if given, returning a dictionary of the cumulative import
+    time (in microseconds) of each top-level module.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-m", "diarydek"] + args,
+        capture_output=True,
+        text=True,
+        check=True,
+        env=env,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        fields = line[len("import time:") :].split("|")
+        name = fields[2].rstrip()
+        if not name.startswith("  "):  # top-level imports only
+            times[name.strip()] = int(fields[1])
+    return times
+
+
+def measure(db, repeat=5):
+    """
+    Return the median total import time, and the modules, of each command.
+    The tag completions come from the sidecar file after the first run.
+    """
+    commands = {
+        "version": ["--version"],
+        "add": ["--database", db, "start-up", "test", ":", "startup"],
+        "complete": ["--database", db, "--complete-tags", "st"],
+    }
+    env = dict(os.environ, XDG_CACHE_HOME=os.path.dirname(db))
+    measured = {}
+    for name, args in commands.items():
+        totals = []
+        for _ in range(repeat):
+            times = import_times(args, env)
+            totals.append(sum(times.values()))
+        totals.sort()
+        measured[name] = (totals[len(totals) // 2], set(times))
+    return measured
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check diarydek start-up time.")
+    parser.add_argument("--update", action="store_true", help="save times as the budget")
+    parser.add_argument(
+        "--slack",
+        type=float,
+        default=0.5,
+        help="fraction by which a budget may be exceeded (default 0.5)",
+    )
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as directory:
+        measured = measure(os.path.join(directory, "startup.db"))
+    failed = False
+    for name, (total, modules) in measured.items():
+        print("%-8s %8d us" % (name, total))
+        for module in forbidden[name]:
+            if module in modules:
+                print("  imports %s, which it should not" % module)
+                failed = True
+    if args.update:
+        with open(budgetFile, "w") as f:
+            json.dump(dict((k, v[0]) for k, v in measured.items()), f, indent=2)
+            f.write("\n")
+    else:
+        with open(budgetFile) as f:
+            budget = json.load(f)
+        for name, (total, modules) in measured.items():
+            if total > budget[name] * (1 + args.slack):
+                print("%s is over budget (%d us)" % (name, budget[name]))
+                failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
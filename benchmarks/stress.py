@@ -0,0 +1,89 @@
+#!/usr/bin/python3
+"""
+Stress test of concurrent writers.
+
+Starts several processes that each add entries to one diary as fast as they
+can, then checks that no entry was lost.  The exit status is 1 if any was.
+
+    python3 benchmarks/stress.py --processes 8 --entries 200
+    python3 benchmarks/stress.py --processes 8 --entries 200 --bulk
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+from time import perf_counter as timer
+
+# Run in each process, with arguments: database, worker number, entries, bulk
+worker = """
+import sys
+from diarydek.diarydek import Diarydek
+db, n, count, bulk = sys.argv[1], int(sys.argv[2]), int(sys.argv[3]), sys.argv[4] == "1"
+diary = Diarydek(db=db, concurrent=True, quiet=True)
+rows = [("2024-01-01 00:00:00", "worker %d entry %d" % (n, i), ["w%d" % n, "stress"])
+        for i in range(count)]
+if bulk:
+    for i in range(0, count, 10):
+        diary.import_entries(rows[i : i + 10])
+else:
+    for row in rows:
+        diary.add_entry(*row)
+"""
+
+
+def stress(db, processes, entries, bulk=False):
+    """
+    Run the writers on database 'db', returning a list of problems found,
+    which is empty if all went well.
+    """
+    children = [
+        subprocess.Popen(
+            [sys.executable, "-c", worker, db, str(n), str(entries), "1" if bulk else "0"],
+            stderr=subprocess.PIPE,
+            text=True,
+        )
+        for n in range(processes)
+    ]
+    problems = []
+    for n, child in enumerate(children):
+        _, err = child.communicate()
+        if child.returncode:
+            problems.append("worker %d failed: %s" % (n, err.strip().splitlines()[-1]))
+    from diarydek.diarydek import Diarydek
+
+    diary = Diarydek(db=db, quiet=True)
+    for n in range(processes):
+        found = sum(1 for _ in diary.iter_entries(tag="w%d" % n))
+        if found != entries:
+            problems.append("worker %d: found %d of %d entries" % (n, found, entries))
+    total = sum(1 for _ in diary.iter_entries(tag="stress"))
+    if total != processes * entries:
+        problems.append("found %d of %d entries" % (total, processes * entries))
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stress-test concurrent diarydek writers.")
+    parser.add_argument("--processes", type=int, default=8, help="number of writers")
+    parser.add_argument("--entries", type=int, default=200, help="entries per writer")
+    parser.add_argument("--bulk", action="store_true", help="write with import_entries()")
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as directory:
+        start = timer()
+        problems = stress(
+            os.path.join(directory, "stress.db"), args.processes, args.entries, args.bulk
+        )
+        elapsed = timer() - start
+    for problem in problems:
+        print(problem)
+    print(
+        "%d processes added %d entries each in %.2fs"
+        % (args.processes, args.entries, elapsed)
+    )
+    sys.exit(1 if problems else 0)
+
+
+if __name__ == "__main__":
+    main()
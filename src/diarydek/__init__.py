@@ -1,3 +1,21 @@
-from .main import mainer
+import sys
+
+
+# The command line is in cli.py, since a submodule named 'main' would, once
+# imported, replace this function as the package's 'main'.
 def main():
-    mainer()
+    from .fast import dispatch
+
+    if not dispatch(sys.argv[1:]):
+        from .cli import mainer
+
+        mainer()
+
+
+def __getattr__(name):
+    # mainer() is imported on demand, since it is slow to import
+    if name == "mainer":
+        from .cli import mainer
+
+        return mainer
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
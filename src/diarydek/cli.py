@@ -0,0 +1,848 @@
+#!/usr/bin/python3
+
+from .diarydek import Diarydek, Entry
+from .client import request, ServerError
+from .render import write_entries
+from .config import appversion, defaultDatabase, separator
+import argparse
+import atexit
+import os
+import sys
+import datetime
+from time import perf_counter as timer
+
+
+def open_text(f, mode, compress=None):
+    """
+    Open a file (given by name, or as a binary file object) for reading or
+    writing CSV text.  Compression is used if 'compress' is True, or if it
+    is None and the filename ends in '.gz'.
+    """
+    if compress is None:
+        compress = isinstance(f, str) and f.endswith(".gz")
+    if compress:
+        import gzip
+
+        return gzip.open(f, mode + "t", newline="")
+    return open(f, mode, newline="")
+
+
+def parse_time(tmp, error):
+    """
+    Parse a time given as "yyyy-mm-dd" or "yyyy-mm-dd HH:MM:SS", calling
+    error() with a message if it is neither.
+    """
+    try:
+        if len(tmp) == 10:
+            return datetime.datetime.strptime(tmp, "%Y-%m-%d")
+        elif len(tmp) == 19:
+            return datetime.datetime.strptime(tmp, "%Y-%m-%d %H:%M:%S")
+    except ValueError:
+        pass
+    error('must give time as "yyyy-mm-dd" or "yyyy-mm-dd HH:MM:SS", not "%s"' % tmp)
+
+
+def stdin_rows(f):
+    """
+    Yield (time, entry, tags) rows for --stdin, from lines of text that are
+    either JSON objects with "entry" and optional "time" and "tags" items,
+    or "entry : tag tag ..." as on the command line, raising ValueError,
+    with the line number, for a line that is neither.  Blank lines are
+    skipped.  Entries without a time get the time at which they were read.
+    """
+    import json
+
+    for number, line in enumerate(f, 1):
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith("{"):
+            try:
+                item = json.loads(line)
+                entry = item["entry"]
+            except (ValueError, KeyError, TypeError):
+                raise ValueError('line %d is not a JSON object with an "entry"' % number)
+            tags = item.get("tags") or []
+            if isinstance(tags, str):
+                tags = tags.split(",")
+            time = item.get("time") or datetime.datetime.now()
+            if not isinstance(entry, str):
+                raise ValueError('line %d has an "entry" that is not a string' % number)
+            if not isinstance(tags, list) or not all(isinstance(tag, str) for tag in tags):
+                raise ValueError('line %d has "tags" that are not a list of strings' % number)
+            if not isinstance(time, (str, datetime.datetime)):
+                raise ValueError('line %d has a "time" that is not a string' % number)
+        else:
+            words = line.split()
+            tags = []
+            if separator in words:
+                start = words.index(separator) + 1
+                tags = words[start:]
+                words = words[0 : start - 1]
+            entry = " ".join(words)
+            time = datetime.datetime.now()
+        if not entry:
+            raise ValueError("line %d has no entry" % number)
+        yield (time, entry, tags)
+
+
+def check_tags(words, error):
+    """
+    Return the tag expression (see tagquery.py) given by the words after the
+    separator, or None if there are none, calling error() if it is malformed.
+    """
+    if not words:
+        return None
+    from .tagquery import parse
+
+    expression = " ".join(words)
+    try:
+        parse(expression)
+    except ValueError as e:
+        error(str(e))
+    return expression
+
+
+def expand_databases(names, error):
+    """
+    Return the database files named by the --database options, expanding
+    any '~' and glob patterns, and calling error() if a pattern matches
+    nothing.
+    """
+    from glob import glob
+
+    databases = []
+    for name in names:
+        name = os.path.expanduser(name)
+        if any(c in name for c in "*?["):
+            matches = sorted(glob(name))
+            if not matches:
+                error("no databases match '%s'" % name)
+            databases.extend(matches)
+        else:
+            databases.append(name)
+    return databases
+
+
+def report_profile(profiler, filename, summary):
+    """Report profiling results, at exit"""
+    if filename:
+        profiler.write_json(filename)
+    if summary:
+        profiler.summary(sys.stderr)
+
+
+def mainer():
+    startTime = timer()
+    # rcfile = "~/.diarydekrc"  # can define defaultDatabase and separator
+    # try:
+    #     f = open(path.expanduser(rcfile))
+    #     rc = json.load(f)
+    #     try:
+    #         tmp = rc["database"]
+    #         defaultDatabase = tmp
+    #     except KeyError:
+    #         pass
+    #     try:
+    #         tmp = rc["separator"]
+    #         separator = tmp
+    #     except KeyError:
+    #         pass
+    #     # defaultDatabase
+    # except IOError:
+    #     pass
+    overallHelp = """
+# Hints
+
+## Merging Databases
+
+The following appends the contents of the database B to database A,
+leaving out entries (with the same time, text and tags) that A already
+has.
+
+    diarydek --database ~/A.db --merge ~/B.db --skipDuplicates
+
+# Suggested Aliases
+
+Another way to specify the database is by using a unix alias, e.g. the
+author uses the following to isolate work and personal diaries.
+
+    alias ',dw'='diarydek --database=~/Documents/diary/work.db'
+    alias ',dp'='diarydek --database=~/Documents/diary/personal.db'
+"""
+    # ## Start-up file
+    #
+    # Some features of how diarydek works can be customized with a file in the
+    # user's top-level directory, called `.diarydekrc`. This file must be
+    # written in JSON format, as in the example below. So far, the only
+    # element that can be altered is the default database name.
+    #
+    #     {
+    #         "database": "~/Dropbox/diarydek.db"
+    #     }
+    import textwrap
+
+    time = datetime.datetime.now()  # can be over-written by --time
+    parser = argparse.ArgumentParser(
+        prog="diary",
+        description="diarydek: a commandline tool for adding entries to a diary database.",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog=textwrap.dedent(overallHelp),
+    )
+    parser.add_argument(
+        "--debug",
+        action="store_true",
+        help="turn on tracer information",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="print a summary of SQL statements and timings, at exit",
+    )
+    parser.add_argument(
+        "--profileJSON",
+        "--profile-json",
+        type=str,
+        default=None,
+        help="write SQL statements and timings to a file, in JSON format",
+        metavar="file.json",
+    )
+    parser.add_argument(
+        "--database",
+        type=str,
+        action="append",
+        default=None,
+        help="set database location (defaults to %s); --list and --writeCSV accept several, or a quoted pattern such as '~/diary/*.db'" % defaultDatabase,
+        metavar="filename",
+    )
+    parser.add_argument(
+        "--concurrent",
+        action="store_true",
+        help="let several processes write at once, by switching the database to write-ahead logging (only if they all run on one computer)",
+    )
+    parser.add_argument(
+        "--serve",
+        action="store_true",
+        help="run a server that keeps the database open, to speed up adding and listing entries",
+    )
+    parser.add_argument(
+        "--direct",
+        action="store_true",
+        help="use the database directly, even if a server is running",
+    )
+    parser.add_argument(
+        "--version", action="store_true", help="show application version number"
+    )
+    parser.add_argument(
+        "--time",
+        type=str,
+        default=None,
+        help='set entry time as yyyy-mm-yy or "yyyy-mm-yy HH:MM:SS" (defaults to present time)',
+        metavar="yyyy-mm-dd",
+    )
+    parser.add_argument(
+        "--showTags", action="store_true", help="show tags in database, with counts"
+    )
+    parser.add_argument(
+        "--completeTags",
+        "--complete-tags",
+        type=str,
+        help="print the tags starting with PREFIX, most used (and recently used) first, for shell completion",
+        metavar="PREFIX",
+    )
+    parser.add_argument(
+        "--completionScript",
+        "--completion-script",
+        type=str,
+        choices=["bash", "zsh"],
+        help="print a script for completing tags in the given shell",
+    )
+    parser.add_argument(
+        "--stats",
+        type=str,
+        nargs="?",
+        const="month",
+        default=None,
+        choices=["day", "week", "month"],
+        help="show the number of entries in each day, week or month (defaults to month), and the tags most often used together",
+    )
+    parser.add_argument(
+        "--rebuildStats",
+        "--rebuild-stats",
+        action="store_true",
+        help="recompute the statistics used by --showTags and --stats",
+    )
+    parser.add_argument(
+        "--showID", action="store_true", help="show <ID> in --list output"
+    )
+    parser.add_argument(
+        "--delete",
+        type=int,
+        nargs="+",
+        default=None,
+        help="delete entries with given IDs",
+        metavar="ID",
+    )
+    parser.add_argument(
+        "--deleteRange",
+        "--delete-range",
+        type=int,
+        nargs=2,
+        default=None,
+        help="delete entries with IDs from first to last, inclusive",
+        metavar=("first", "last"),
+    )
+    parser.add_argument(
+        "--deleteMatching",
+        "--delete-matching",
+        action="store_true",
+        help="delete entries matching the words, tags, --since, --until and --match given, as for --list",
+    )
+    parser.add_argument(
+        "--addTag",
+        "--add-tag",
+        type=str,
+        default=None,
+        help="add a tag to the entries matching the words, tags, --since, --until and --match given",
+        metavar="tag",
+    )
+    parser.add_argument(
+        "--removeTag",
+        "--remove-tag",
+        type=str,
+        default=None,
+        help="remove a tag from the entries matching the words, tags, --since, --until and --match given",
+        metavar="tag",
+    )
+    parser.add_argument(
+        "--mergeTags",
+        "--merge-tags",
+        type=str,
+        nargs=2,
+        help="merge a tag into another, which need not exist",
+        metavar=("old", "new"),
+    )
+    parser.add_argument(
+        "--vacuum",
+        action="store_true",
+        help="delete unused tags and orphaned links, and compact the database",
+    )
+    parser.add_argument("--list", action="store_true", help="print entries")
+    parser.add_argument(
+        "--format",
+        type=str,
+        choices=["text", "tsv", "jsonl"],
+        default="text",
+        help="format of --list output: text (the default), tab-separated values, or JSON Lines",
+    )
+    parser.add_argument(
+        "--since",
+        type=str,
+        nargs=1,
+        help='restrict --list or --writeCSV to entries after a time, as yyyy-mm-dd or "yyyy-mm-dd HH:MM:SS"',
+        metavar="yyyy-mm-dd",
+    )
+    parser.add_argument(
+        "--until",
+        type=str,
+        default=None,
+        help="restrict --list or --writeCSV to entries before a time",
+        metavar="yyyy-mm-dd",
+    )
+    parser.add_argument(
+        "--between",
+        type=str,
+        nargs=2,
+        help="restrict --list or --writeCSV to entries between two times",
+        metavar=("start", "end"),
+    )
+    parser.add_argument(
+        "--match",
+        type=str,
+        default=None,
+        help='restrict --list to entries matching a full-text query, e.g. \'"blue heron" OR egret*\'',
+        metavar="query",
+    )
+    parser.add_argument(
+        "--rank",
+        action="store_true",
+        help="order --list text searches by relevance, not by time",
+    )
+    parser.add_argument(
+        "--limit",
+        type=int,
+        default=None,
+        help="show at most N entries in --list",
+        metavar="N",
+    )
+    parser.add_argument(
+        "--tail",
+        type=int,
+        default=None,
+        help="show only the last N entries in --list",
+        metavar="N",
+    )
+    parser.add_argument(
+        "--reverse",
+        action="store_true",
+        help="show --list entries newest first",
+    )
+    parser.add_argument(
+        "--writeCSV",
+        action="store_true",
+        help="write entries to stdout, in CSV format handled by --readCSV",
+    )
+    parser.add_argument(
+        "--output",
+        type=str,
+        default=None,
+        help="write --writeCSV or --exportSinceSeq output to a file, compressed if its name ends in .gz",
+        metavar="file.csv",
+    )
+    parser.add_argument(
+        "--gzip",
+        action="store_true",
+        help="compress --writeCSV output with gzip",
+    )
+    parser.add_argument(
+        "--readCSV",
+        type=str,
+        default=None,
+        help="read CSV information into database, reversing --writeCSV action (.gz files are decompressed)",
+        metavar="file.csv",
+    )
+    parser.add_argument(
+        "--merge",
+        type=str,
+        default=None,
+        help="add the entries of another diarydek database",
+        metavar="other.db",
+    )
+    parser.add_argument(
+        "--skipDuplicates",
+        "--skip-duplicates",
+        action="store_true",
+        help="when adding, importing or merging, skip entries with the same time, text and tags as one already present",
+    )
+    parser.add_argument(
+        "--dedupe",
+        action="store_true",
+        help="delete entries with the same time, text and tags as an earlier one",
+    )
+    parser.add_argument(
+        "--exportSinceSeq",
+        "--export-since-seq",
+        type=int,
+        default=None,
+        help="write the changes made after sequence number N (0 for all), as JSON lines ending with the number to use next time",
+        metavar="N",
+    )
+    parser.add_argument(
+        "--applyChanges",
+        "--apply-changes",
+        type=str,
+        default=None,
+        help="apply changes written by --exportSinceSeq, from a file, or - for stdin",
+        metavar="changes.jsonl",
+    )
+    parser.add_argument(
+        "--stdin",
+        action="store_true",
+        help='add entries read from stdin, one per line, either as "entry : tags" or as JSON objects with "time", "entry" and "tags"',
+    )
+    parser.add_argument(
+        "--batch",
+        type=int,
+        default=1000,
+        help="with --stdin, commit after every N entries (defaults to 1000)",
+        metavar="N",
+    )
+    parser.add_argument(
+        "--renameTag",
+        type=str,
+        nargs=2,
+        help="rename a tag",
+        metavar=("old", "new"),
+    )
+    parser.add_argument(
+        "words",
+        type=str,
+        nargs="*",
+        help="diary entry, optionally followed by `:` and then tags",
+    )
+    args = parser.parse_args()
+    profiler = None
+    if args.profile or args.profileJSON:
+        from .tracing import Profiler
+
+        profiler = Profiler()
+        profiler.origin = startTime
+        profiler.add("parse", timer() - startTime)
+        atexit.register(report_profile, profiler, args.profileJSON, args.profile)
+    if args.words:
+        if separator in args.words:
+            start = args.words.index(separator) + 1
+            tags = args.words[start : len(args.words)]
+            entry = " ".join(map(str, args.words[0 : start - 1]))
+        else:
+            entry = " ".join(map(str, args.words))
+            tags = []
+    else:
+        entry = []
+        tags = []
+    if args.debug:
+        print("  separator %s" % separator)
+        print("  defaultDatabase %s" % defaultDatabase)
+        print("  entry: %s" % entry)
+        print("  tags:  %s" % tags)
+    databases = expand_databases(args.database or [defaultDatabase], parser.error)
+    args.database = databases[0]
+    if len(databases) > 1:
+        if not (args.list or args.writeCSV):
+            parser.error("several databases can only be used with --list and --writeCSV")
+        for db in databases:
+            if not os.path.exists(db):
+                parser.error("no database named '%s'" % db)
+    if args.version:
+        (major, minor, subminor) = appversion
+        print("diary version %d.%d.%d" % (major, minor, subminor))
+        sys.exit(0)
+    if args.completionScript:
+        from .complete import scripts
+
+        sys.stdout.write(scripts[args.completionScript])
+        sys.exit(0)  # handle --completionScript
+    if args.completeTags is not None:
+        if args.words:
+            parser.error("extra words after '--completeTags PREFIX'")
+        from .complete import print_completions
+
+        print_completions(args.database, args.completeTags)
+        sys.exit(0)  # handle --completeTags
+    if args.time:
+        time = parse_time(args.time, parser.error)
+    since = None
+    until = None
+    if args.since:
+        since = parse_time(args.since[0], parser.error)
+    if args.until:
+        until = parse_time(args.until, parser.error)
+    if args.between:
+        since = parse_time(args.between[0], parser.error)
+        until = parse_time(args.between[1], parser.error)
+    if args.debug:
+        print("  time interval: %s to %s" % (since, until))
+
+    if args.serve:
+        from .server import serve
+
+        serve(args.database, concurrent=args.concurrent, debug=args.debug)
+        sys.exit(0)
+    if args.list:
+        if args.debug:
+            print("handling --list with --since=%s --until=%s" % (since, until))
+        tagSearch = []
+        entrySearch = ""
+        if args.words:
+            if separator in args.words:
+                start = args.words.index(separator) + 1
+                tagSearch = args.words[start : len(args.words)]
+                entrySearch = " ".join(map(str, args.words[0 : start - 1]))
+            else:
+                entrySearch = " ".join(map(str, args.words))
+            if args.debug:
+                print("  args.words:  %s" % args.words)
+                print("  entrySearch: '%s'" % entrySearch)
+                print("  tagSearch:   %s" % tagSearch)
+            tagSearch = check_tags(tagSearch, parser.error)
+        filters = dict(
+            since=since, until=until, tag=tagSearch, text=entrySearch, match=args.match
+        )
+        # hand the work to a server, if one is running (see server.py)
+        if not (args.direct or profiler or len(databases) > 1):
+            replies = request(
+                args.database,
+                {
+                    "op": "list",
+                    "filters": dict(
+                        filters,
+                        since=since and str(since),
+                        until=until and str(until),
+                    ),
+                    "tail": args.tail,
+                    "reverse": args.reverse,
+                    "limit": args.limit,
+                    "order": "rank" if args.rank else "time",
+                },
+            )
+            if replies is not None:
+                try:
+                    write_entries(
+                        (Entry(*reply["entry"]) for reply in replies), args.format, args.showID
+                    )
+                except ServerError as e:
+                    print("Error: %s" % e, file=sys.stderr)
+                    sys.exit(1)
+                sys.exit(0)  # handle --list, by the server
+    openTime = timer()
+    diary = Diarydek(
+        debug=args.debug,
+        db=args.database,
+        profiler=profiler,
+        concurrent=args.concurrent,
+    )
+    if profiler:
+        profiler.add("open", timer() - openTime)
+
+    if args.renameTag:
+        if args.words:
+            diary.error("extra words after '--rename-tags old new'")
+
+        diary.rename_tag(args.renameTag[0], args.renameTag[1])
+        exit(0)
+
+    if args.debug:
+        print("  database: '%s'" % args.database)
+
+    if args.showTags:
+        print("Tags in database, with counts:")
+        for row in diary.get_tags_with_counts():
+            print(" %10s: %d" % (row[0], row[1]))
+        sys.exit(0)  # handle --showTags
+
+    if args.rebuildStats:
+        diary.rebuild_stats()
+        diary.fyi("Rebuilt statistics")
+        sys.exit(0)  # handle --rebuildStats
+
+    if args.stats:
+        print("Entries per %s:" % args.stats)
+        for bucket, count in diary.get_period_counts(args.stats):
+            print(" %10s: %d" % (bucket, count))
+        pairs = diary.get_tag_pairs()
+        if pairs:
+            print("Tags most often used together:")
+            for tagA, tagB, count in pairs:
+                print(" %10s + %s: %d" % (tagA, tagB, count))
+        sys.exit(0)  # handle --stats
+    start = timer()
+
+    def progress(count):
+        if sys.stderr.isatty():
+            rate = count / max(timer() - start, 1e-6)
+            print("\r%d rows (%.0f rows/sec)" % (count, rate), end="", file=sys.stderr)
+
+    count = 0  # rows read by --stdin or --readCSV
+
+    def counted(count_):
+        nonlocal count
+        count = count_
+        progress(count_)
+
+    def report_skipped(added):
+        if args.skipDuplicates and count > added:
+            diary.warning("skipped %d duplicate entries" % (count - added))
+
+    if args.stdin:
+        try:
+            added = diary.ingest_entries(
+                stdin_rows(sys.stdin),
+                batchSize=args.batch,
+                progress=counted,
+                skipDuplicates=args.skipDuplicates,
+            )
+        except KeyboardInterrupt:
+            print("", file=sys.stderr)
+            diary.error("interrupted, after reading %d entries" % count)
+        except ValueError as e:
+            diary.error("%s (after reading %d entries)" % (e, count))
+        if sys.stderr.isatty():
+            print("", file=sys.stderr)
+        report_skipped(added)
+        sys.exit(0)  # handle --stdin
+
+    if args.readCSV:
+
+        def csv_rows(f):
+            from csv import reader
+
+            for row in reader(f):
+                (time, entry, tagsWithCommas) = row[:3]  # --writeCSV may label rows
+                yield (time, entry, tagsWithCommas.split(","))
+
+        try:
+            with open_text(args.readCSV, "r") as f:
+                added = diary.import_entries(
+                    csv_rows(f), progress=counted, skipDuplicates=args.skipDuplicates
+                )
+        except KeyboardInterrupt:
+            print("", file=sys.stderr)
+            diary.error("import interrupted, so no entries were added")
+        except ValueError as e:
+            diary.error("cannot import '%s': %s" % (args.readCSV, e))
+        if sys.stderr.isatty():
+            print("", file=sys.stderr)
+        elapsed = max(timer() - start, 1e-6)
+        diary.fyi("imported %d rows in %.2fs (%.0f rows/sec)" % (count, elapsed, count / elapsed))
+        report_skipped(added)
+        sys.exit(0)  # handle --readCSV
+
+    if args.merge:
+        try:
+            added, skipped = diary.merge_database(args.merge, skipDuplicates=args.skipDuplicates)
+        except ValueError as e:
+            diary.error("merge failed: %s" % e)
+        elapsed = max(timer() - start, 1e-6)
+        diary.fyi("merged %d entries (skipping %d) in %.2fs" % (added, skipped, elapsed))
+        sys.exit(0)  # handle --merge
+
+    if args.exportSinceSeq is not None:
+        import json
+
+        out = open_text(args.output, "w") if args.output else sys.stdout
+        try:
+            for change in diary.iter_changes(args.exportSinceSeq):
+                out.write(json.dumps(change) + "\n")
+        finally:
+            if out is not sys.stdout:
+                out.close()
+        sys.exit(0)  # handle --exportSinceSeq
+
+    if args.applyChanges:
+        import json
+
+        f = sys.stdin if args.applyChanges == "-" else open_text(args.applyChanges, "r")
+        try:
+            count = diary.apply_changes(json.loads(line) for line in f if line.strip())
+        except (ValueError, KeyError) as e:
+            diary.error("cannot apply changes from '%s': %s" % (args.applyChanges, e))
+        finally:
+            if f is not sys.stdin:
+                f.close()
+        diary.fyi("applied %d changes" % count)
+        sys.exit(0)  # handle --applyChanges
+
+    if args.dedupe:
+        print("Deleted %d duplicate entries." % diary.dedupe())
+        sys.exit(0)  # handle --dedupe
+
+    # Write database to CSV, optionally narrowed
+    if args.writeCSV:
+        tagSearch = None
+        entrySearch = None
+        if args.words:
+            if args.debug:
+                print("  args.words:  %s" % args.words)
+            if separator in args.words:
+                start = args.words.index(separator) + 1
+                tagSearch = args.words[start : len(args.words)]
+                entrySearch = " ".join(map(str, args.words[0 : start - 1]))
+            else:
+                entrySearch = " ".join(map(str, args.words))
+            if args.debug:
+                print("  entrySearch: '%s'" % entrySearch)
+                print("  tagSearch:   %s" % tagSearch)
+            tagSearch = check_tags(tagSearch, diary.error)
+        if args.output:
+            out = open_text(args.output, "w", compress=args.gzip or None)
+        elif args.gzip:
+            out = open_text(sys.stdout.buffer, "w", compress=True)
+        else:
+            out = sys.stdout
+        try:
+            if len(databases) > 1:
+                from .multi import write_csv
+
+                write_csv(
+                    out, databases, since=since, until=until, tag=tagSearch, text=entrySearch
+                )
+            else:
+                diary.write_csv(
+                    out, since=since, until=until, tag=tagSearch, text=entrySearch
+                )
+        finally:
+            if out is not sys.stdout:
+                out.close()
+        sys.exit(0)  # handle --writeCSV
+
+    if args.delete:
+        if args.debug:
+            print("handling --delete with IDs %s" % args.delete)
+        if len(args.delete) == 1:
+            diary.delete_by_id(args.delete[0])
+        elif diary.delete_entries(ids=args.delete) < len(args.delete):
+            diary.warning("some of the IDs were not in the database")
+        sys.exit(0)  # handle --delete
+
+    if args.deleteRange:
+        count = diary.delete_entries(first=args.deleteRange[0], last=args.deleteRange[1])
+        print("Deleted %d entries." % count)
+        sys.exit(0)  # handle --deleteRange
+
+    if args.mergeTags:
+        diary.merge_tags(args.mergeTags[0], args.mergeTags[1])
+        sys.exit(0)  # handle --mergeTags
+
+    if args.vacuum:
+        links, unused = diary.vacuum()
+        print("Deleted %d orphaned links and %d unused tags." % (links, unused))
+        sys.exit(0)  # handle --vacuum
+
+    if args.deleteMatching or args.addTag or args.removeTag:
+        # the entries are chosen as for --list
+        filters = dict(
+            since=since,
+            until=until,
+            tag=check_tags(tags, diary.error),
+            text=entry or None,
+            match=args.match,
+        )
+        try:
+            if args.deleteMatching:
+                print("Deleted %d entries." % diary.delete_entries(**filters))
+            elif args.addTag:
+                print("Tagged %d entries." % diary.tag_entries(args.addTag, **filters))
+            else:
+                print("Untagged %d entries." % diary.untag_entries(args.removeTag, **filters))
+        except ValueError as e:
+            diary.error("%s; give words, tags, --since, --until or --match" % e)
+        sys.exit(0)  # handle --deleteMatching, --addTag and --removeTag
+
+    if args.list:
+        if len(databases) > 1:
+            from functools import partial
+            from .multi import iter_many
+
+            if args.rank:
+                diary.error("cannot rank entries from several databases")
+            find = partial(iter_many, databases, debug=args.debug)
+        else:
+            find = diary.iter_entries
+        if args.tail is not None:
+            # read backwards from the end, then put in the requested order
+            entries = list(find(reverse=True, limit=args.tail, **filters))
+            if not args.reverse:
+                entries.reverse()
+        else:
+            entries = find(
+                order="rank" if args.rank else "time",
+                reverse=args.reverse,
+                limit=args.limit,
+                **filters
+            )
+        if profiler:
+            listTime = timer()
+            entries = profiler.iterate(entries, "query")
+        write_entries(entries, args.format, args.showID, labelled=len(databases) > 1)
+        if profiler:
+            profiler.add("render", timer() - listTime - profiler.phases["query"])
+        sys.exit(0)  # handle --list
+
+    # Database insertion
+    elif args.words:
+        addTime = timer()
+        diary.add_entry(time, entry, tags, skipDuplicate=args.skipDuplicates)
+        if profiler:
+            profiler.add("add", timer() - addTime)
+    else:
+        print("Try -h to learn how to use this")
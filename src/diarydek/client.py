@@ -0,0 +1,81 @@
+#!/usr/bin/python3
+"""
+Client side of the diarydek server (see server.py).
+
+The command-line tool uses request() to hand work to a running server, and
+falls back to using the database directly if request() returns None.  This
+module is used on the fast start-up path, so it imports little until it
+knows that a server is listening.
+"""
+
+import os
+
+
+class ServerError(Exception):
+    """An error reported by the server"""
+
+
+def socket_path(db):
+    """
+    Return the name of the socket on which a server for database 'db'
+    listens.  It is in a directory of the user's own, within their runtime
+    directory (or /tmp), not beside the database, which may be in a synced
+    folder.
+    """
+    from zlib import crc32
+
+    db = os.path.abspath(os.path.expanduser(db))
+    directory = os.environ.get("XDG_RUNTIME_DIR") or os.environ.get("TMPDIR") or "/tmp"
+    uid = os.getuid() if hasattr(os, "getuid") else 0
+    return os.path.join(directory, "diarydek-%d" % uid, "%08x.sock" % crc32(db.encode()))
+
+
+def private(path):
+    """
+    Return whether 'path' belongs to this user, and cannot be used by others.
+    The socket of a server, and its directory, are trusted only if so, since
+    /tmp is open to everyone, and another user could listen there.
+    """
+    try:
+        info = os.lstat(path)
+    except OSError:
+        return False
+    uid = os.getuid() if hasattr(os, "getuid") else 0
+    return info.st_uid == uid and not info.st_mode & 0o077
+
+
+def request(db, message, timeout=30.0):
+    """
+    Send 'message', a dictionary, to the server for database 'db', returning
+    an iterator over its replies (also dictionaries), or None if no server
+    is running.  A ServerError is raised if the server reports an error.
+    """
+    path = socket_path(db)
+    if not os.path.exists(path):
+        return None
+    if not (private(os.path.dirname(path)) and private(path)):
+        return None  # not a server of ours
+    import json
+    import socket
+
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    s.settimeout(timeout)
+    try:
+        s.connect(path)
+    except OSError:
+        s.close()
+        return None  # a socket left behind by a server that has stopped
+    s.sendall((json.dumps(message) + "\n").encode())
+    return _replies(s, json)
+
+
+def _replies(s, json):
+    with s, s.makefile("rb") as f:
+        for line in f:
+            reply = json.loads(line)
+            if "error" in reply:
+                raise ServerError(reply["error"])
+            if reply.get("end"):
+                return
+            yield reply
+    raise ServerError("the server closed the connection early")
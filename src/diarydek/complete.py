@@ -0,0 +1,175 @@
+#!/usr/bin/python3
+"""
+Completion of tag names, as used by 'diarydek --complete-tags PREFIX' and by
+the shell scripts that 'diarydek --completionScript bash' (or zsh) prints.
+
+Shell completion runs diarydek on every press of the tab key, so it must be
+quick.  The tags, with the number of entries using each and the time each
+was last used, are kept in a small tab-separated sidecar file, in the
+user's cache directory (not beside the database, which may be in a synced
+folder).  Its first line records the state of the database and its
+write-ahead log (see stamp()), and it is rebuilt, from the statistics
+tables (see diarydek.py), only when that has changed.  Answering from it
+needs neither sqlite3 nor the Diarydek class.
+"""
+
+import os
+import sys
+import time
+
+# how long it takes the weight of a use of a tag to halve, in days
+halfLife = 90.0
+
+scripts = {
+    "bash": """\
+# bash completion of diarydek tags, after the ':' separator
+_diarydek() {
+    local cur=${COMP_WORDS[COMP_CWORD]} i tagging=0
+    local -a db=()
+    for ((i = 1; i < COMP_CWORD; i++)); do
+        case ${COMP_WORDS[i]} in
+            :) tagging=1 ;;
+            --database) db=(--database "${COMP_WORDS[i + 1]}") ;;
+        esac
+    done
+    if ((tagging)); then
+        local IFS=$'\\n'
+        COMPREPLY=($(diarydek "${db[@]}" --complete-tags "$cur" 2>/dev/null))
+    fi
+}
+complete -o default -F _diarydek diarydek
+""",
+    "zsh": """\
+#compdef diarydek
+# zsh completion of diarydek tags, after the ':' separator, best first
+_diarydek() {
+    local i
+    local -a db
+    for ((i = 2; i < CURRENT; i++)); do
+        [[ $words[i] == --database ]] && db=(--database "$words[i+1]")
+    done
+    if (( ${words[(I):]} > 1 && ${words[(I):]} < CURRENT )); then
+        compadd -V tags -- ${(f)"$(diarydek $db --complete-tags "$PREFIX" 2>/dev/null)"}
+    else
+        _files
+    fi
+}
+compdef _diarydek diarydek
+""",
+}
+
+
+def cache_path(db):
+    """Return the name of the sidecar file holding the tags of database 'db'"""
+    from zlib import crc32
+
+    db = os.path.abspath(os.path.expanduser(db))
+    directory = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(directory, "diarydek", "tags-%08x.tsv" % crc32(db.encode()))
+
+
+def stamp(db):
+    """
+    Return a string that changes whenever database 'db' is written.  It
+    holds the size and time of the database file and of its write-ahead log,
+    with the change counter in the database header, which a commit updates
+    unless the log is in use, and the salts in the header of the log, which
+    change only when a checkpoint resets it.  Between resets, each commit
+    appends to the log, so that its size grows even if its time does not
+    change.
+    """
+    parts = []
+    for name, start, end in ((db, 24, 28), (db + "-wal", 16, 24)):
+        try:
+            with open(name, "rb") as f:
+                info = os.fstat(f.fileno())
+                header = f.read(end)[start:end]
+            parts.append("%d:%d:%s" % (info.st_size, info.st_mtime_ns, header.hex()))
+        except OSError:
+            parts.append("-")
+    return " ".join(parts)
+
+
+def read_tags(db):
+    """
+    Return a list of (tag, count, lastUsed) for database 'db', in which
+    lastUsed is the epoch (see diarydek.epoch_sql()) of the latest entry
+    given the tag, rebuilding the sidecar file if it is out of date.
+    """
+    db = os.path.expanduser(db)
+    path = cache_path(db)
+    current = stamp(db)
+    try:
+        with open(path, encoding="utf-8") as f:
+            if f.readline().rstrip("\n") == "# " + current:
+                rows = []
+                for line in f:
+                    tag, count, lastUsed = line.rstrip("\n").split("\t")
+                    rows.append((tag, int(count), int(lastUsed)))
+                return rows
+    except (OSError, ValueError):
+        pass
+    rows = query_tags(db)
+    write_tags(path, current, rows)
+    return rows
+
+
+def query_tags(db):
+    """Return a list of (tag, count, lastUsed) read from database 'db'"""
+    import sqlite3
+    from pathlib import Path
+
+    if not os.path.exists(db):
+        return []
+    # quoted, since '?', '#' and '%' in the name would be read as parts of the URI
+    con = sqlite3.connect(Path(os.path.abspath(db)).as_uri() + "?mode=ro", uri=True)
+    try:
+        return con.execute(
+            """SELECT t.tag, c.count, IFNULL(c.lastUsed, 0)
+            FROM tag_counts c JOIN tags t ON t.tagId = c.tagId
+            ORDER BY t.tag;"""
+        ).fetchall()
+    except sqlite3.OperationalError:
+        return []  # a database from an older version, until diarydek upgrades it
+    finally:
+        con.close()
+
+
+def write_tags(path, current, rows):
+    """Write the sidecar file, replacing any old one in a single step"""
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = "%s.%d" % (path, os.getpid())
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write("# %s\n" % current)
+            for tag, count, lastUsed in rows:
+                if "\t" not in tag and "\n" not in tag:
+                    f.write("%s\t%d\t%d\n" % (tag, count, lastUsed))
+        os.replace(tmp, path)
+    except OSError:
+        pass  # a read-only cache only costs speed
+
+
+def complete_tags(db, prefix, limit=50, now=None):
+    """
+    Return up to 'limit' tags of database 'db' that start with 'prefix',
+    best first, ranking each by its number of uses, weighted by how
+    recently it was last used, at 'now' (in seconds since 1970, local
+    time taken as UTC, as for epochs).
+    """
+    if now is None:
+        # entry times are local, but epochs treat them as UTC
+        now = time.time() + time.localtime().tm_gmtoff
+    scored = []
+    for tag, count, lastUsed in read_tags(db):
+        if tag.startswith(prefix):
+            age = max(now - lastUsed / 1e6, 0.0) / 86400.0
+            scored.append((-count * 0.5 ** (age / halfLife), tag))
+    scored.sort()
+    return [tag for score, tag in scored[:limit]]
+
+
+def print_completions(db, prefix):
+    """Print the completions of 'prefix', one per line"""
+    for tag in complete_tags(db, prefix):
+        sys.stdout.write(tag + "\n")
@@ -0,0 +1,10 @@
+#!/usr/bin/python3
+
+# Settings needed at start-up.  This module must stay free of imports, so
+# that the fast command-line path (see fast.py) can use it cheaply.
+
+# DEVELOPER: next line must match version in toml file
+appversion = [0, 0, 33]
+
+defaultDatabase = "~/diarydek.db"
+separator = ":"
@@ -4,40 +4,501 @@ from __future__ import print_function
 import sys
 import sqlite3 as sqlite
 import os.path
+from .config import appversion
+import datetime
+from collections import namedtuple
+from contextlib import contextmanager
+from itertools import islice
+from hashlib import sha1
+from time import sleep
 
 authorId = "Dan Kelley"
 
 
+def epoch_sql(time):
+    """
+    Return an SQL expression for the canonical form of the time string given
+    by the SQL expression 'time', i.e. microseconds since 1970-01-01, taking
+    the time to be UTC.  Strings that SQLite cannot parse map to NULL; such
+    entries come after all others in time order, and are in no time range.
+    """
+    return (
+        "CAST(strftime('%%s', substr(%s, 1, 19)) AS INTEGER) * 1000000"
+        " + CASE WHEN substr(%s, 20, 1) = '.'"
+        " THEN CAST(substr(substr(%s, 21) || '000000', 1, 6) AS INTEGER)"
+        " ELSE 0 END" % (time, time, time)
+    )
+
+
+def to_epoch(time):
+    """
+    Return the canonical form (see epoch_sql()) of a datetime, or of a
+    "yyyy-mm-dd", "yyyy-mm-dd HH:MM:SS" or "yyyy-mm-dd HH:MM:SS.ffffff" string.
+    """
+    if isinstance(time, str):
+        time = datetime.datetime.fromisoformat(time)
+    return (time - datetime.datetime(1970, 1, 1)) // datetime.timedelta(microseconds=1)
+
+
+def entry_hash(epoch, entry, tags, time=None):
+    """
+    Return the content hash of an entry, given its epoch (see epoch_sql()),
+    text and list of tag names, and its time, which is used in place of the
+    epoch if that is None, as for times that cannot be read.  Whitespace
+    around and within the text is normalised, and the order and repetition
+    of tags are ignored, so two entries with the same hash are duplicates.
+    In SQL, this is available as entry_hash(epoch, entry, tags, time), with
+    the tag names joined by tagSeparator.
+    """
+    tags = sorted(set(tag.strip() for tag in tags) - {""})
+    if epoch is None:
+        when = "?" + " ".join(str(time or "").split())
+    else:
+        when = "%d" % epoch
+    text = "%s\x1f%s\x1f%s" % (when, " ".join((entry or "").split()), "\x1f".join(tags))
+    return sha1(text.encode("utf-8")).digest()
+
+
+def _entry_hash_sql(epoch, entry, tags, time):
+    return entry_hash(epoch, entry, tags.split(tagSeparator) if tags else [], time)
+
+
+# The tag names of the entry with ID given by the SQL expression 'entryId',
+# as used by entry_hash().
+entryTagsSql = """(SELECT GROUP_CONCAT(t.tag, char(31))
+    FROM entry_tags et JOIN tags t ON t.tagId = et.tagId
+    WHERE et.entryId = +%s)"""
+
+# Recomputation of the hashes of entries, e.g. after tags are renamed; a
+# WHERE clause may be appended.
+updateHashes = "UPDATE entries SET hash = entry_hash(epoch, entry, %s, time)" % (
+    entryTagsSql % "entries.entryId"
+)
+
+
+# Filling in of the epoch of entries added by programs that do not set it,
+# e.g. versions of diarydek before 0.0.28, scripts, and the sqlite3 shell.
+epochSchema = [
+    """CREATE TRIGGER IF NOT EXISTS entries_epoch_insert AFTER INSERT ON entries
+    WHEN NEW.epoch IS NULL BEGIN
+        UPDATE entries SET epoch = %s WHERE entryId = NEW.entryId;
+    END;"""
+    % epoch_sql("NEW.time"),
+]
+
+# Schema version of a freshly-initialized database, before any migrations.
+baseVersion = (0, 0, 25)
+
+# Schema migrations, applied in order by Diarydek.migrate().  Each item is
+# (version, description, steps), where version is what the database becomes
+# once the steps succeed, and steps is a list of SQL statements or of
+# functions taking the Diarydek object.  The steps of a migration run in a
+# single transaction, and the 'version' table is updated within it, so an
+# interrupted upgrade leaves the database as it was.
+#
+# DEVELOPER: to change the schema, bump appversion in config.py (and the toml
+# file), then append a migration keyed to that version.  Never edit a
+# migration that has been released, since databases in the wild have already
+# applied it.
+migrations = [
+    (
+        (0, 0, 26),
+        "add indexes, and make tag names unique",
+        [
+            # Older databases may hold several rows for one tag name, so
+            # point links at the first such row and drop the others before
+            # the unique index is created.
+            """UPDATE entry_tags SET tagId = (
+                SELECT MIN(t2.tagId) FROM tags t1
+                JOIN tags t2 ON t2.tag = t1.tag
+                WHERE t1.tagId = entry_tags.tagId)
+            WHERE tagId IN (SELECT tagId FROM tags);""",
+            # An entry linked to two such rows now has two links to one tag.
+            """DELETE FROM entry_tags WHERE entryTagId NOT IN (
+                SELECT MIN(entryTagId) FROM entry_tags GROUP BY entryId, tagId);""",
+            # Links to missing entries or tags, which older versions left
+            # behind, would be counted in the statistics (see 0.0.29).
+            """DELETE FROM entry_tags
+            WHERE entryId NOT IN (SELECT entryId FROM entries)
+            OR tagId NOT IN (SELECT tagId FROM tags);""",
+            "DELETE FROM tags WHERE tagId NOT IN (SELECT MIN(tagId) FROM tags GROUP BY tag);",
+            "CREATE UNIQUE INDEX IF NOT EXISTS tags_tag ON tags(tag);",
+            "CREATE INDEX IF NOT EXISTS entries_time ON entries(time);",
+            "CREATE INDEX IF NOT EXISTS entry_tags_entryId ON entry_tags(entryId);",
+            "CREATE INDEX IF NOT EXISTS entry_tags_tagId ON entry_tags(tagId);",
+        ],
+    ),
+    (
+        (0, 0, 27),
+        "add a full-text index of entries, if FTS5 is available",
+        [lambda diary: diary.create_fts()],
+    ),
+    (
+        (0, 0, 28),
+        "add a canonical, indexed, time column",
+        [
+            "ALTER TABLE entries ADD COLUMN epoch INTEGER;",
+            "UPDATE entries SET epoch = %s;" % epoch_sql("time"),
+            "CREATE INDEX IF NOT EXISTS entries_epoch ON entries(epoch);",
+        ]
+        + epochSchema,
+    ),
+    (
+        (0, 0, 29),
+        "add statistics tables, kept up to date by triggers",
+        [lambda diary: diary.create_stats()],
+    ),
+    (
+        (0, 0, 30),
+        "add content hashes of entries, for finding duplicates",
+        [
+            "ALTER TABLE entries ADD COLUMN hash BLOB;",
+            updateHashes + ";",
+            # Not UNIQUE, since diaries may hold duplicates already, and
+            # adding them is allowed unless asked otherwise.
+            "CREATE INDEX IF NOT EXISTS entries_hash ON entries(hash);",
+        ],
+    ),
+    (
+        (0, 0, 31),
+        "add a journal of changes, for syncing diaries",
+        [lambda diary: diary.create_changes()],
+    ),
+    (
+        (0, 0, 32),
+        "give entry_tags typed columns and foreign keys, dropping orphaned links",
+        [
+            """CREATE TABLE entry_tags_new(
+            entryTagId INTEGER PRIMARY KEY AUTOINCREMENT,
+            entryId INTEGER NOT NULL REFERENCES entries(entryId) ON DELETE CASCADE,
+            tagId INTEGER NOT NULL REFERENCES tags(tagId) ON DELETE CASCADE);""",
+            """INSERT INTO entry_tags_new(entryTagId, entryId, tagId)
+            SELECT entryTagId, entryId, tagId FROM entry_tags
+            WHERE entryId IN (SELECT entryId FROM entries)
+            AND tagId IN (SELECT tagId FROM tags)
+            ORDER BY entryTagId;""",
+            "DROP TABLE entry_tags;",
+            "ALTER TABLE entry_tags_new RENAME TO entry_tags;",
+            "CREATE INDEX entry_tags_entryId ON entry_tags(entryId);",
+            "CREATE INDEX entry_tags_tagId ON entry_tags(tagId);",
+            # dropping the table dropped its triggers; the counts still
+            # hold, since 0.0.26 dropped the orphaned links
+            lambda diary: diary.create_stats(fill=False),
+            lambda diary: diary.create_changes(journal=False),
+        ],
+    ),
+    (
+        (0, 0, 33),
+        "record when each tag was last used, for ranking tag completions",
+        [
+            "ALTER TABLE tag_counts ADD COLUMN lastUsed INTEGER;",
+            lambda diary: diary.create_last_used(),
+        ],
+    ),
+]
+
+# Full-text index of entries.entry, kept in step with the entries table by
+# triggers.  Being an external-content table, it does not duplicate the text.
+ftsSchema = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS entries_fts
+    USING fts5(entry, content='entries', content_rowid='entryId');""",
+    """CREATE TRIGGER IF NOT EXISTS entries_fts_insert AFTER INSERT ON entries BEGIN
+        INSERT INTO entries_fts(rowid, entry) VALUES (new.entryId, new.entry);
+    END;""",
+    """CREATE TRIGGER IF NOT EXISTS entries_fts_delete AFTER DELETE ON entries BEGIN
+        INSERT INTO entries_fts(entries_fts, rowid, entry)
+        VALUES ('delete', old.entryId, old.entry);
+    END;""",
+    """CREATE TRIGGER IF NOT EXISTS entries_fts_update AFTER UPDATE OF entry ON entries BEGIN
+        INSERT INTO entries_fts(entries_fts, rowid, entry)
+        VALUES ('delete', old.entryId, old.entry);
+        INSERT INTO entries_fts(rowid, entry) VALUES (new.entryId, new.entry);
+    END;""",
+    "INSERT INTO entries_fts(entries_fts) VALUES ('rebuild');",
+]
+
+
+# Summary statistics, kept up to date by triggers, so that reports need not
+# aggregate the whole diary: the number of links of each tag, the number of
+# entries in each day, week and month, and the number of entries having
+# each pair of tags (with tagA < tagB).  Rows whose counts reach zero are
+# removed.  Diarydek.rebuild_stats() recomputes them from scratch.
+periods = {"day": "%Y-%m-%d", "week": "%Y-W%W", "month": "%Y-%m"}
+
+
+def _bucket(epoch, period):
+    return "strftime('%s', %s / 1000000, 'unixepoch')" % (periods[period], epoch)
+
+
+def _count_periods(epoch, change):
+    # entries without an epoch (see epochSchema) fall in no period
+    return "".join(
+        """INSERT INTO period_counts(period, bucket, count)
+        SELECT '%s', %s, %d WHERE %s IS NOT NULL
+        ON CONFLICT(period, bucket) DO UPDATE SET count = count + %d;
+        """
+        % (period, _bucket(epoch, period), change, epoch, change)
+        for period in periods
+    )
+
+
+def _count_link(link, change):
+    return """INSERT INTO tag_counts(tagId, count) VALUES (%(link)s.tagId, %(change)d)
+        ON CONFLICT(tagId) DO UPDATE SET count = count + %(change)d;
+        INSERT INTO tag_pairs(tagA, tagB, count)
+        SELECT MIN(et.tagId, %(link)s.tagId), MAX(et.tagId, %(link)s.tagId), %(change)d
+        FROM entry_tags et
+        WHERE et.entryId = +%(link)s.entryId
+          AND et.entryTagId != %(link)s.entryTagId AND et.tagId != %(link)s.tagId
+        ON CONFLICT(tagA, tagB) DO UPDATE SET count = count + %(change)d;
+        """ % {"link": link, "change": change}
+
+
+statsCleanup = """DELETE FROM period_counts WHERE count <= 0;
+        DELETE FROM tag_counts WHERE count <= 0;
+        DELETE FROM tag_pairs WHERE count <= 0;
+        """
+
+statsSchema = [
+    """CREATE TABLE IF NOT EXISTS tag_counts(
+        tagId INTEGER PRIMARY KEY, count INTEGER NOT NULL);""",
+    """CREATE TABLE IF NOT EXISTS period_counts(
+        period TEXT, bucket TEXT, count INTEGER NOT NULL,
+        PRIMARY KEY(period, bucket)) WITHOUT ROWID;""",
+    """CREATE TABLE IF NOT EXISTS tag_pairs(
+        tagA INTEGER, tagB INTEGER, count INTEGER NOT NULL,
+        PRIMARY KEY(tagA, tagB)) WITHOUT ROWID;""",
+    """CREATE TRIGGER IF NOT EXISTS stats_entry_insert AFTER INSERT ON entries BEGIN
+        %s
+    END;"""
+    % _count_periods("NEW.epoch", 1),
+    """CREATE TRIGGER IF NOT EXISTS stats_entry_delete AFTER DELETE ON entries BEGIN
+        %s
+        DELETE FROM period_counts WHERE count <= 0;
+    END;"""
+    % _count_periods("OLD.epoch", -1),
+    """CREATE TRIGGER IF NOT EXISTS stats_entry_update AFTER UPDATE OF epoch ON entries BEGIN
+        %s%s
+        DELETE FROM period_counts WHERE count <= 0;
+    END;"""
+    % (_count_periods("OLD.epoch", -1), _count_periods("NEW.epoch", 1)),
+    """CREATE TRIGGER IF NOT EXISTS stats_link_insert AFTER INSERT ON entry_tags BEGIN
+        %s
+    END;"""
+    % _count_link("NEW", 1),
+    """CREATE TRIGGER IF NOT EXISTS stats_link_delete AFTER DELETE ON entry_tags BEGIN
+        %s%s
+    END;"""
+    % (_count_link("OLD", -1), statsCleanup),
+    """CREATE TRIGGER IF NOT EXISTS stats_link_update AFTER UPDATE ON entry_tags BEGIN
+        %s%s%s
+    END;"""
+    % (_count_link("OLD", -1), _count_link("NEW", 1), statsCleanup),
+    """CREATE TRIGGER IF NOT EXISTS stats_tag_delete AFTER DELETE ON tags BEGIN
+        DELETE FROM tag_counts WHERE tagId = OLD.tagId;
+        DELETE FROM tag_pairs WHERE tagA = OLD.tagId OR tagB = OLD.tagId;
+    END;""",
+]
+
+# Journal of changes, filled in by triggers, and read by
+# Diarydek.iter_changes() to export the changes made after a given sequence
+# number.  Each row records one of
+#
+#     add     entry 'entryId' was added (its details are read on export)
+#     delete  entry 'entryId', with 'time' and 'entry', was deleted
+#     tag     tag named 'tag' was linked to entry 'entryId'
+#     untag   tag named 'tag' was unlinked from entry 'entryId'
+#     rename  tag named 'old' was renamed as 'tag'
+#
+# The sequence numbers increase, and are never reused.
+changesSchema = [
+    """CREATE TABLE IF NOT EXISTS changes(
+        seq INTEGER PRIMARY KEY AUTOINCREMENT, op TEXT NOT NULL,
+        entryId INTEGER, time TEXT, entry TEXT, tag TEXT, old TEXT);""",
+    """CREATE TRIGGER IF NOT EXISTS changes_entry_insert AFTER INSERT ON entries BEGIN
+        INSERT INTO changes(op, entryId) VALUES ('add', NEW.entryId);
+    END;""",
+    """CREATE TRIGGER IF NOT EXISTS changes_entry_delete AFTER DELETE ON entries BEGIN
+        INSERT INTO changes(op, entryId, time, entry)
+        VALUES ('delete', OLD.entryId, OLD.time, OLD.entry);
+    END;""",
+    """CREATE TRIGGER IF NOT EXISTS changes_link_insert AFTER INSERT ON entry_tags BEGIN
+        INSERT INTO changes(op, entryId, tag)
+        VALUES ('tag', NEW.entryId, (SELECT tag FROM tags WHERE tagId = NEW.tagId));
+    END;""",
+    """CREATE TRIGGER IF NOT EXISTS changes_link_delete AFTER DELETE ON entry_tags BEGIN
+        INSERT INTO changes(op, entryId, tag)
+        VALUES ('untag', OLD.entryId, (SELECT tag FROM tags WHERE tagId = OLD.tagId));
+    END;""",
+    """CREATE TRIGGER IF NOT EXISTS changes_link_update AFTER UPDATE ON entry_tags BEGIN
+        INSERT INTO changes(op, entryId, tag)
+        VALUES ('untag', OLD.entryId, (SELECT tag FROM tags WHERE tagId = OLD.tagId));
+        INSERT INTO changes(op, entryId, tag)
+        VALUES ('tag', NEW.entryId, (SELECT tag FROM tags WHERE tagId = NEW.tagId));
+    END;""",
+    """CREATE TRIGGER IF NOT EXISTS changes_tag_rename AFTER UPDATE OF tag ON tags
+    WHEN OLD.tag IS NOT NEW.tag BEGIN
+        INSERT INTO changes(op, tag, old) VALUES ('rename', NEW.tag, OLD.tag);
+    END;""",
+]
+
+# The epoch of the latest entry having each tag, in tag_counts.lastUsed, as
+# used to rank completions of tag names (see complete.py).  The triggers
+# only ever move it forward, so deleting the latest use of a tag leaves it
+# too recent until Diarydek.rebuild_stats() is run.  They upsert, since
+# they may run before the stats_link triggers have made the row.
+_lastUsed = """INSERT INTO tag_counts(tagId, count, lastUsed)
+        SELECT %s, 0, e.epoch FROM %s
+        ON CONFLICT(tagId) DO UPDATE
+        SET lastUsed = MAX(IFNULL(lastUsed, 0), excluded.lastUsed);"""
+
+lastUsedSchema = [
+    """CREATE TRIGGER IF NOT EXISTS last_used_link_insert AFTER INSERT ON entry_tags BEGIN
+        %s
+    END;"""
+    % (_lastUsed % ("NEW.tagId", "entries e WHERE e.entryId = NEW.entryId AND e.epoch NOTNULL")),
+    """CREATE TRIGGER IF NOT EXISTS last_used_link_update AFTER UPDATE ON entry_tags BEGIN
+        %s
+    END;"""
+    % (_lastUsed % ("NEW.tagId", "entries e WHERE e.entryId = NEW.entryId AND e.epoch NOTNULL")),
+    """CREATE TRIGGER IF NOT EXISTS last_used_entry_update AFTER UPDATE OF epoch ON entries BEGIN
+        %s
+    END;"""
+    % (
+        _lastUsed
+        % (
+            "et.tagId",
+            "entries e JOIN entry_tags et ON et.entryId = e.entryId"
+            " WHERE e.entryId = NEW.entryId AND e.epoch NOTNULL",
+        )
+    ),
+]
+
+# An entry as yielded by Diarydek.iter_entries(); 'tags' is a list of names,
+# and 'epoch' is the canonical form of 'time' (see epoch_sql()).
+Entry = namedtuple("Entry", ["entryId", "time", "entry", "tags", "epoch"])
+
+# Insertion of an entry, given its time, text and tags (joined by
+# tagSeparator).
+insertEntry = """INSERT INTO entries(time,entry,epoch,hash)
+SELECT ?1, ?2, epoch, entry_hash(epoch, ?2, ?3, ?1)
+FROM (SELECT %s AS epoch);""" % epoch_sql("?1")
+
+# The ID of an entry that is a duplicate of one with the given time, text
+# and tags, if there is one.
+findDuplicate = (
+    "SELECT entryId FROM entries WHERE hash = entry_hash(%s, ?2, ?3, ?1) LIMIT 1;"
+    % epoch_sql("?1")
+)
+
+# Warning about entries whose times SQLite cannot read (see epoch_sql()).
+unreadableTime = (
+    "cannot read %s as yyyy-mm-dd HH:MM:SS; such entries are listed after all "
+    "others, and left out of --since, --until, --between and --stats"
+)
+
+
+def _unreadable(count):
+    return "the time of 1 entry" if count == 1 else "the times of %d entries" % count
+
+
+# The epoch given by Diarydek.to_columns() for times that cannot be read,
+# being the smallest 64-bit integer.
+noEpoch = -(2**63)
+
+# Separator used to aggregate tag names within a query; tag names never
+# contain it, unlike ',' which older versions permitted.
+tagSeparator = "\x1f"
+
+# Entries, with their tags aggregated in order of linkage.  The 'join',
+# 'where' and 'order' items are filled in by Diarydek.iter_entries().
+#
+# The columns of entry_tags were declared without types before version
+# 0.0.32, so comparing them with the INTEGER keys of other tables would apply
+# an affinity to the indexed side, and prevent the use of its index.  The
+# unary '+' on the other side removes that affinity.
+entryQuery = """
+SELECT e.entryId, e.time, e.entry,
+  (SELECT GROUP_CONCAT(tag, char(31)) FROM (
+    SELECT t.tag FROM entry_tags et
+    JOIN tags t ON t.tagId = et.tagId
+    WHERE et.entryId = +e.entryId
+    ORDER BY et.entryTagId)),
+  e.epoch
+FROM entries e
+%(join)s
+%(where)s
+ORDER BY %(order)s;
+"""
+
+
 class Diarydek:
-    def __init__(self, db="~/Dropbox/diarydek.db", debug=0, quiet=False):
+    def __init__(
+        self,
+        db="~/Dropbox/diarydek.db",
+        debug=0,
+        quiet=False,
+        profiler=None,
+        concurrent=False,
+        timeout=5.0,
+        retries=8,
+    ):
         """
-        A class used for the storing and searching diary notes.
+        A class used for the storing and searching diary notes.  If a
+        tracing.Profiler is given, it records the SQL statements run.
+
+        Writers wait up to 'timeout' seconds for a lock held by another
+        process, and then retry up to 'retries' more times, with increasing
+        delays.  If 'concurrent' is True, the database is switched to
+        write-ahead logging, which lets readers proceed during writes, and
+        makes commits cheaper.  (This is a lasting property of the database
+        file, and needs every process using it to be on the same computer.)
         """
         self.debug = debug
         self.quiet = quiet
+        self.profiler = profiler
+        self.retries = retries
         self.db = db
         self.fyi("Database '%s' (before path expansion)." % self.db)
         self.db = os.path.expanduser(self.db)
         self.fyi("Database '%s' (after path expansion)." % self.db)
         mustInitialize = not os.path.exists(self.db)
         if mustInitialize:
-            print('Creating new database named "%s".' % self.db)
+            if not self.quiet:
+                print('Creating new database named "%s".' % self.db)
         else:
             dbsize = os.path.getsize(self.db)
             self.fyi("Database file size %s bytes." % dbsize)
             mustInitialize = not dbsize
         try:
-            con = sqlite.connect(self.db)
+            if profiler:
+                con = profiler.connect(self.db, timeout=timeout)
+            else:
+                con = sqlite.connect(self.db, timeout=timeout)
             con.text_factory = str  # permit accented characters
+            con.create_function("entry_hash", 4, _entry_hash_sql, deterministic=True)
+            if concurrent:
+                # this needs an exclusive lock, for which SQLite may not wait
+                self._execute_retrying(con.cursor(), "PRAGMA journal_mode=WAL;")
+                # with WAL, this is still safe against corruption, and only
+                # risks losing the last commits on a power failure
+                con.execute("PRAGMA synchronous=NORMAL;")
         except Exception:
             self.error("Error opening connection to database named '%s'" % db)
             raise
         self.con = con
         self.cur = con.cursor()
         self.authorId = authorId
-        # DEVELOPER: next line must match version in toml file
-        self.appversion = [0, 0, 25]
+        self.fts = None  # whether entries_fts exists; see has_fts()
+        self.tagIds = None  # tag name to ID; see tag_cache()
+        self.tagIdsVersion = None
+        self.tagBitmaps = {}  # tag name to bitmap of entries; see tag_bitmaps()
+        self.tagBitmapsVersion = None
+        self.appversion = list(appversion)  # see config.py
         self.dbversion = self.appversion
+        if not mustInitialize and not self.cur.execute("SELECT 1 FROM sqlite_master;").fetchone():
+            # created by another process, which has yet to initialize it
+            mustInitialize = True
         if mustInitialize:
             self.initialize()
         try:
@@ -45,19 +506,14 @@ class Diarydek:
         except Exception:
             self.warning("cannot get version number in database")
             self.dbversion = [0, 1, 0]
-        appversion = "%s.%s.%s" % (
-            self.appversion[0],
-            self.appversion[1],
-            self.appversion[2],
-        )
-        dbversion = "%s.%s.%s" % (
-            self.dbversion[0],
-            self.dbversion[1],
-            self.dbversion[2],
-        )
-        self.fyi("appversion: %s" % appversion)
-        self.fyi("dbversion: %s" % dbversion)
-        self.fyi("self.dbversion: %s" % [self.dbversion])
+        self.migrate()
+        # deleting an entry deletes its links to tags (this must be set
+        # outside transactions, and after migrations rebuild tables)
+        self.con.execute("PRAGMA foreign_keys=ON;")
+        if self.debug:
+            self.fyi("appversion: %d.%d.%d" % tuple(self.appversion))
+            self.fyi("dbversion: %d.%d.%d" % tuple(self.dbversion))
+            self.fyi("self.dbversion: %s" % [self.dbversion])
 
     def fyi(self, msg, prefix="  "):
         if self.debug:
@@ -81,82 +537,513 @@ class Diarydek:
 
     def delete_by_id(self, id):
         self.fyi("delete_by_id with id=%d" % (id,))
-        IDs = [entry[0] for entry in self.get_table("entries")]
-        if id not in IDs:
+        if not self.delete_entries(ids=[id]):
             self.error("there is no entry with ID=%d" % id)
-        q = "DELETE FROM entries WHERE entryId=%d;" % id
-        self.fyi(q)
-        self.cur.execute(q)
-        self.con.commit()
+
+    def _choose(self, cur, ids=None, first=None, last=None, **filters):
+        """
+        Fill the temporary table 'chosen' with the IDs of the entries given
+        by a list of 'ids', by the range 'first' to 'last', and by the
+        keyword arguments of iter_entries(), all of which must hold.  Raises
+        ValueError if none is given, as a guard against acting on the whole
+        diary by mistake.
+        """
+        join, conditions, params = self._filter(**filters)
+        if ids is not None:
+            conditions.append("e.entryId IN (SELECT value FROM json_each(?))")
+            params.append("[%s]" % ",".join("%d" % id for id in ids))
+        if first is not None:
+            conditions.append("e.entryId >= ?")
+            params.append(first)
+        if last is not None:
+            conditions.append("e.entryId <= ?")
+            params.append(last)
+        if not conditions:
+            raise ValueError("no entries were specified")
+        cur.execute("CREATE TEMP TABLE IF NOT EXISTS chosen(entryId INTEGER PRIMARY KEY);")
+        cur.execute("DELETE FROM chosen;")
+        cur.execute(
+            "INSERT INTO chosen(entryId) SELECT e.entryId FROM entries e %s WHERE %s;"
+            % (join, " AND ".join(conditions)),
+            params,
+        )
+
+    def delete_entries(self, ids=None, first=None, last=None, **filters):
+        """
+        Delete the entries chosen by a list of 'ids', by the range of IDs
+        'first' to 'last', and by the keyword arguments of iter_entries(),
+        in one transaction, returning the number deleted.  Their links to
+        tags are deleted by cascade.  Raises ValueError if no entries are
+        specified.
+        """
+        with self.transaction() as cur:
+            self._choose(cur, ids, first, last, **filters)
+            count = cur.execute("DELETE FROM entries WHERE entryId IN chosen;").rowcount
+        self.fyi("deleted %d entries" % count)
+        return count
+
+    def tag_entries(self, name, ids=None, first=None, last=None, **filters):
+        """
+        Add the tag called 'name' to the entries chosen as for
+        delete_entries() that lack it, in one transaction, returning the
+        number tagged.
+        """
+        name = self._tag_name(name)
+        with self.transaction() as cur:
+            self._choose(cur, ids, first, last, **filters)
+            tagId = self.tag_ids([name])[0]
+            cur.execute(
+                """DELETE FROM chosen WHERE entryId IN
+                (SELECT entryId FROM entry_tags WHERE tagId = ?);""",
+                (tagId,),
+            )
+            count = cur.execute(
+                "INSERT INTO entry_tags(entryId, tagId) SELECT entryId, ? FROM chosen;",
+                (tagId,),
+            ).rowcount
+            cur.execute(updateHashes + " WHERE entryId IN chosen;")
+        return count
+
+    def untag_entries(self, name, ids=None, first=None, last=None, **filters):
+        """
+        Remove the tag called 'name' from the entries chosen as for
+        delete_entries(), in one transaction, returning the number untagged.
+        """
+        name = self._tag_name(name)
+        with self.transaction() as cur:
+            self._choose(cur, ids, first, last, **filters)
+            count = cur.execute(
+                """DELETE FROM entry_tags WHERE entryId IN chosen
+                AND tagId = (SELECT tagId FROM tags WHERE tag = ?);""",
+                (name,),
+            ).rowcount
+            cur.execute(updateHashes + " WHERE entryId IN chosen;")
+        return count
+
+    def merge_tags(self, old, new):
+        """
+        Merge tag 'old' into tag 'new' (which need not exist), in one
+        transaction, so that entries that had either have 'new'.
+        """
+        with self.transaction() as cur:
+            if not self._rename(cur, old, new):
+                self.error('There is no tag named "%s"' % old)
+        self.tagIds = None
+
+    def vacuum(self):
+        """
+        Tidy the database: delete links to missing entries or tags (which
+        older versions of diarydek, or other programs, could leave), and
+        tags that no entry uses, then compact the full-text index and the
+        database file.  Returns a tuple of the number of links and of tags
+        deleted.
+        """
+        with self.transaction() as cur:
+            links = cur.execute(
+                """DELETE FROM entry_tags
+                WHERE entryId NOT IN (SELECT entryId FROM entries)
+                OR tagId NOT IN (SELECT tagId FROM tags);"""
+            ).rowcount
+            tags = cur.execute(
+                "DELETE FROM tags WHERE tagId NOT IN (SELECT tagId FROM entry_tags);"
+            ).rowcount
+            if self.has_fts():
+                cur.execute("INSERT INTO entries_fts(entries_fts) VALUES('optimize');")
+        self.tagIds = None
+        self.cur.execute("VACUUM;")
+        self.cur.execute("PRAGMA optimize;")
+        self.fyi("deleted %d orphaned links and %d unused tags" % (links, tags))
+        return (links, tags)
 
     def rename_tag(self, old, new):
         self.fyi("rename_tag with old='%s' and new='%s'" % (old, new))
-        tagNames = [tag[1] for tag in self.get_table("tags")]
-        if old not in tagNames:
+        cur = self.con.cursor()
+        if not cur.execute("SELECT 1 FROM tags WHERE tag=?;", (old,)).fetchone():
             self.error('There is no tag named "%s"' % old)
-        else:
-            q = "UPDATE tags SET tag = '%s' WHERE tag = '%s';" % (new, old)
-            self.fyi(q)
-            self.cur.execute(q)
-            self.con.commit()
+        if cur.execute("SELECT 1 FROM tags WHERE tag=?;", (new,)).fetchone():
+            self.error('There is already a tag named "%s"' % new)
+        with self.transaction() as cur:
+            self._rename(cur, old, new)
+        self.tagIds = None
 
-    def add_entry(self, time, entry, tags):
+    def add_entry(self, time, entry, tags, skipDuplicate=False):
+        """
+        Add an entry with the given time and tags, returning its ID.  This is
+        done in one transaction.  If 'skipDuplicate' is True and the diary
+        already has an entry with the same time, text and tags (see
+        entry_hash()), nothing is added, and None is returned.
+        """
         self.fyi("add_entry...")
         self.fyi("  entry: %s" % entry)
         if not len(entry):
             self.error("Must supply an entry before the ':' character.")
         self.fyi("  tags:  %s" % tags)
-        self.cur.execute("INSERT INTO entries(time,entry) VALUES(?,?);", (time, entry))
-        entryId = self.cur.lastrowid
-        self.fyi("entryID %d" % entryId)
-        self.con.commit()
-        # add tags to known list
-        q = self.cur.execute("SELECT tag from tags;").fetchall()
-        self.con.commit()
-        tagsOld = [tag[0] for tag in q]
-        self.fyi("  existing tags: %s" % tagsOld)
-        for tag in tags:
-            if tag not in tagsOld:
-                self.fyi("%s: adding to db" % tag)
-                self.cur.execute("INSERT INTO tags(tag) VALUES(?);", (tag,))
-                self.con.commit()
-        # add linkages
-        for tag in tags:
-            self.fyi("tag %s" % tag)
-            tagId = self.cur.execute(
-                "SELECT tagId FROM tags WHERE tag='%s';" % tag
-            ).fetchall()[0]
-            self.con.commit()
-            self.fyi("tagId %d" % tagId)
-            self.cur.execute(
+        tags = list(dict.fromkeys(tags))  # drop repeats, retaining order
+        with self.transaction() as cur:
+            params = (str(time), entry, tagSeparator.join(tags))
+            if skipDuplicate:
+                duplicate = cur.execute(findDuplicate, params).fetchone()
+                if duplicate:
+                    self.warning("not adding a duplicate of entry %d" % duplicate[0])
+                    return None
+            cur.execute(insertEntry, params)
+            entryId = cur.lastrowid
+            self.fyi("entryID %d" % entryId)
+            unreadable = cur.execute(
+                "SELECT epoch IS NULL FROM entries WHERE entryId = ?;", (entryId,)
+            ).fetchone()[0]
+            if unreadable:
+                self.warning(unreadableTime % ("the time '%s'" % time))
+            cur.executemany(
                 "INSERT INTO entry_tags(entryId,tagId) VALUES(?,?);",
-                (entryId, tagId[0]),
+                [(entryId, tagId) for tagId in self.tag_ids(tags)],
             )
-            self.con.commit()
         self.fyi("done adding")
+        return entryId
 
-    def create_tag(self, tag):
-        """Create a new tag"""
+    @contextmanager
+    def transaction(self):
+        """
+        Context manager for a write transaction, yielding a cursor.  The write
+        lock is taken at the start, and the transaction is committed at the
+        end, or rolled back if an exception occurs.
+        """
+        cur = self.con.cursor()
+        self.begin(cur)
+        try:
+            yield cur
+            self.con.commit()
+        except BaseException:
+            self.con.rollback()
+            self.tagIds = None  # may hold tags that were rolled back
+            raise
+
+    def begin(self, cur):
+        """
+        Begin a write transaction, waiting for other writers to finish.  The
+        wait set by the 'timeout' argument of the constructor is retried,
+        with randomized and increasing delays, before giving up.
+        """
+        self._execute_retrying(cur, "BEGIN IMMEDIATE")
+
+    def _execute_retrying(self, cur, q):
+        """Execute 'q', retrying as described for begin() while the database is locked"""
+        delay = 0.05
+        for attempt in range(self.retries + 1):
+            try:
+                cur.execute(q)
+                return
+            except sqlite.OperationalError as e:
+                if attempt == self.retries or "locked" not in str(e):
+                    raise
+                from random import random
+
+                self.fyi("database is locked; retrying in %.2fs" % delay)
+                sleep(delay * (0.5 + random()))
+                delay = min(2 * delay, 2.0)
+
+    def tag_cache(self):
+        """
+        Return a dictionary mapping tag names to IDs.  This is cached, but is
+        reloaded if another connection has changed the database, or if tags
+        have been renamed (see rename_tag()).
+        """
+        dataVersion = self.cur.execute("PRAGMA data_version;").fetchone()[0]
+        if self.tagIds is None or dataVersion != self.tagIdsVersion:
+            self.tagIds = dict(self.con.cursor().execute("SELECT tag, tagId FROM tags;"))
+            self.tagIdsVersion = dataVersion
+        return self.tagIds
+
+    def tag_ids(self, tags):
+        """
+        Return a list of the IDs of the named tags, adding any new ones to the
+        tags table.  This is meant to be called within a transaction.
+        """
+        cache = self.tag_cache()
+        missing = [tag for tag in tags if tag not in cache]
+        if missing:
+            self.fyi("adding tags %s" % missing)
+            cur = self.con.cursor()
+            cur.executemany(
+                "INSERT OR IGNORE INTO tags(tag) VALUES(?);", [(tag,) for tag in missing]
+            )
+            cache.update(
+                cur.execute(
+                    "SELECT tag, tagId FROM tags WHERE tag IN (%s);"
+                    % ",".join("?" * len(missing)),
+                    missing,
+                )
+            )
+        return [cache[tag] for tag in tags]
+
+    def import_entries(self, rows, batchSize=1000, progress=None, skipDuplicates=False):
+        """
+        Add entries in bulk, from an iterable of (time, entry, tags) items, in
+        which 'tags' is a list of tag names.  The rows are added in a single
+        transaction, so an error or an interruption leaves the database as it
+        was.  Within that, rows are inserted in batches of 'batchSize', after
+        each of which 'progress' (if given) is called with the number of rows
+        read so far.  If 'skipDuplicates' is True, rows that duplicate an
+        entry (see entry_hash()), including one added earlier in the same
+        import, are skipped.  Returns the number of entries added.
+        """
+        # Holding the write lock from the start means that nobody else can
+        # add entries, so entry IDs can be assigned here rather than looked
+        # up one insertion at a time.
+        with self.transaction() as cur:
+            tagIds = self.tag_cache()
+            entryId = cur.execute(
+                """SELECT MAX(IFNULL(MAX(entryId), 0),
+                IFNULL((SELECT seq FROM sqlite_sequence WHERE name='entries'), 0))
+                FROM entries;"""
+            ).fetchone()[0]
+            count = 0
+            added = 0
+            entryBatch = []
+            linkBatch = []
+            for time, entry, tags in rows:
+                if not len(entry):
+                    raise ValueError("row %d has no entry" % (count + 1))
+                entryId += 1
+                names = []
+                # drop repeats, retaining order, as add_entry() does
+                for tag in dict.fromkeys(tag.strip() for tag in tags):
+                    if not tag:
+                        continue
+                    tagId = tagIds.get(tag)
+                    if tagId is None:
+                        tagId = self.tag_ids([tag])[0]
+                    names.append(tag)
+                    linkBatch.append((entryId, tagId))
+                entryBatch.append((entryId, str(time), entry, tagSeparator.join(names)))
+                count += 1
+                if len(entryBatch) >= batchSize:
+                    added += self._insert_batch(cur, entryBatch, linkBatch, skipDuplicates)
+                    if progress:
+                        progress(count)
+            added += self._insert_batch(cur, entryBatch, linkBatch, skipDuplicates)
+            unreadable = cur.execute(
+                "SELECT COUNT(*) FROM entries WHERE entryId > ? AND epoch IS NULL;",
+                (entryId - count,),
+            ).fetchone()[0]
+        if unreadable:
+            self.warning(unreadableTime % _unreadable(unreadable))
+        if progress:
+            progress(count)
+        return added
+
+    def ingest_entries(self, rows, batchSize=1000, progress=None, skipDuplicates=False):
+        """
+        Add entries from an iterable of (time, entry, tags) items, as for
+        import_entries(), but committing after each batch of 'batchSize'
+        rows, so that entries from a long-running stream become visible as
+        they arrive.  If an error occurs, earlier batches are kept.  Returns
+        the number of entries added.
+        """
+        rows = iter(rows)
+        count = 0
+        added = 0
+        while True:
+            batch = list(islice(rows, batchSize))
+            if not batch:
+                break
+            added += self.import_entries(
+                batch, batchSize=batchSize, skipDuplicates=skipDuplicates
+            )
+            count += len(batch)
+            if progress:
+                progress(count)
+        return added
+
+    def merge_database(self, db, skipDuplicates=False):
+        """
+        Add the entries of another diarydek database, with their tags.  The
+        other database is attached, and entries and entry-tag links are
+        copied by a few INSERT ... SELECT statements in one transaction,
+        with the source's tag IDs mapped to this database's (adding tags as
+        needed) and its entry IDs placed after this database's.  If
+        'skipDuplicates' is True, entries that duplicate one in this
+        database, or an earlier one in the other (see entry_hash()), are not
+        copied.  Returns a tuple of the number of entries added and the
+        number skipped.
+        """
+        path = os.path.expanduser(db)
+        if not os.path.isfile(path):
+            raise ValueError("no database named '%s'" % db)
+        if os.path.isfile(self.db) and os.path.samefile(path, self.db):
+            raise ValueError("cannot merge a database into itself")
+        cur = self.con.cursor()
+        cur.execute("ATTACH DATABASE ? AS source;", (path,))
+        try:
+            try:
+                tables = [
+                    row[0]
+                    for row in cur.execute(
+                        "SELECT name FROM source.sqlite_master WHERE type='table';"
+                    )
+                ]
+            except sqlite.DatabaseError as e:
+                raise ValueError("cannot read '%s': %s" % (db, e))
+            for table in ["tags", "entries", "entry_tags"]:
+                if table not in tables:
+                    raise ValueError("'%s' is not a diarydek database" % db)
+            with self.transaction() as cur:
+                cur.execute(
+                    """INSERT OR IGNORE INTO main.tags(tag)
+                    SELECT tag FROM source.tags GROUP BY tag ORDER BY MIN(tagId);"""
+                )
+                cur.execute(
+                    """CREATE TEMP TABLE merge_tags(
+                    oldId INTEGER PRIMARY KEY, newId INTEGER);"""
+                )
+                cur.execute(
+                    """INSERT INTO merge_tags(oldId, newId)
+                    SELECT s.tagId, t.tagId
+                    FROM source.tags s JOIN main.tags t ON t.tag = s.tag;"""
+                )
+                offset = cur.execute(
+                    """SELECT MAX(IFNULL(MAX(entryId), 0),
+                    IFNULL((SELECT seq FROM main.sqlite_sequence WHERE name='entries'), 0))
+                    FROM main.entries;"""
+                ).fetchone()[0]
+                cur.execute(
+                    """CREATE TEMP TABLE merge_entries(
+                    oldId INTEGER PRIMARY KEY, newId INTEGER, epoch INTEGER, hash BLOB);"""
+                )
+                # The epoch and hash are computed afresh, as the source may
+                # be from a version of diarydek that lacked them.
+                cur.execute(
+                    """INSERT INTO merge_entries(oldId, newId, epoch, hash)
+                    SELECT c.oldId, ?1 + ROW_NUMBER() OVER (ORDER BY c.oldId), c.epoch, c.hash
+                    FROM (
+                      SELECT oldId, epoch, hash,
+                        ROW_NUMBER() OVER (PARTITION BY hash ORDER BY oldId) AS copy
+                      FROM (
+                        SELECT s.entryId AS oldId, s.epoch,
+                          entry_hash(s.epoch, s.entry, st.tags, s.time) AS hash
+                        FROM (SELECT entryId, time, entry, %s AS epoch FROM source.entries) s
+                        LEFT JOIN (
+                          SELECT et.entryId, GROUP_CONCAT(t.tag, char(31)) AS tags
+                          FROM source.entry_tags et
+                          JOIN source.tags t ON t.tagId = et.tagId
+                          GROUP BY et.entryId) st
+                        ON st.entryId = s.entryId)) c
+                    WHERE NOT ?2 OR (c.copy = 1 AND NOT EXISTS (
+                      SELECT 1 FROM main.entries e WHERE e.hash = c.hash));"""
+                    % epoch_sql("time"),
+                    (offset, skipDuplicates),
+                )
+                added = cur.execute(
+                    """INSERT INTO main.entries(entryId, time, entry, epoch, hash)
+                    SELECT m.newId, s.time, s.entry, m.epoch, m.hash
+                    FROM merge_entries m JOIN source.entries s ON s.entryId = m.oldId
+                    ORDER BY m.newId;"""
+                ).rowcount
+                # A source from before 0.0.26 may have several rows for one
+                # tag name, which all map to one tag here, so an entry
+                # linked to two of them gets one link.
+                cur.execute(
+                    """INSERT INTO main.entry_tags(entryId, tagId)
+                    SELECT m.newId, t.newId
+                    FROM source.entry_tags et
+                    JOIN merge_entries m ON m.oldId = et.entryId
+                    JOIN merge_tags t ON t.oldId = et.tagId
+                    GROUP BY m.newId, t.newId
+                    ORDER BY MIN(et.entryTagId);"""
+                )
+                total = cur.execute("SELECT COUNT(*) FROM source.entries;").fetchone()[0]
+                unreadable = cur.execute(
+                    "SELECT COUNT(*) FROM merge_entries WHERE epoch IS NULL;"
+                ).fetchone()[0]
+                cur.execute("DROP TABLE merge_tags;")
+                cur.execute("DROP TABLE merge_entries;")
+        finally:
+            self.con.execute("DETACH DATABASE source;")
+        self.tagIds = None
+        if unreadable:
+            self.warning(unreadableTime % _unreadable(unreadable))
+        self.fyi("merged %d entries from '%s', skipping %d" % (added, db, total - added))
+        return (added, total - added)
+
+    def dedupe(self):
+        """
+        Delete the entries that duplicate an earlier one (see entry_hash()),
+        with their links to tags, returning the number deleted.
+        """
+        with self.transaction() as cur:
+            # entries added by other programs may lack hashes
+            cur.execute(updateHashes + " WHERE hash IS NULL;")
+            cur.execute("CREATE TEMP TABLE dedupe(entryId INTEGER PRIMARY KEY);")
+            cur.execute(
+                """INSERT INTO dedupe(entryId)
+                SELECT entryId FROM (
+                  SELECT entryId, ROW_NUMBER() OVER (PARTITION BY hash ORDER BY entryId) AS copy
+                  FROM entries)
+                WHERE copy > 1;"""
+            )
+            cur.execute("DELETE FROM entry_tags WHERE entryId IN dedupe;")
+            count = cur.execute("DELETE FROM entries WHERE entryId IN dedupe;").rowcount
+            cur.execute("DROP TABLE dedupe;")
+        self.fyi("deleted %d duplicate entries" % count)
+        return count
+
+    def _insert_batch(self, cur, entryBatch, linkBatch, skipDuplicates=False):
+        """
+        Insert, and then clear, batches of entries and entry-tag links,
+        returning the number of entries inserted.  If 'skipDuplicates' is
+        True, duplicate entries are not inserted, nor are their links.
+        """
+        q = """INSERT INTO entries(entryId,time,entry,epoch,hash)
+        SELECT ?1, ?2, ?3, epoch, hash FROM (
+          SELECT epoch, entry_hash(epoch, ?3, ?4, ?2) AS hash FROM (SELECT %s AS epoch)) h"""
+        q %= epoch_sql("?2")
+        if skipDuplicates:
+            q += " WHERE NOT EXISTS (SELECT 1 FROM entries e WHERE e.hash = h.hash)"
+        cur.executemany(q + ";", entryBatch)
+        added = cur.rowcount
+        q = "INSERT INTO entry_tags(entryId,tagId) "
+        if skipDuplicates and added < len(entryBatch):
+            q += "SELECT ?1, ?2 WHERE EXISTS (SELECT 1 FROM entries WHERE entryId = ?1);"
+        else:
+            q += "VALUES(?,?);"
+        cur.executemany(q, linkBatch)
+        del entryBatch[:]
+        del linkBatch[:]
+        return added
+
+    def _tag_name(self, tag):
+        """Return 'tag' stripped of space, calling error() if it cannot be a tag"""
         tag = tag.strip()
         if not len(tag):
             self.error("Cannot have a blank book name")
         if tag.find(",") >= 0:
             self.error("Cannot have a ',' in a tag")
-        existing = self.list_tags()
-        if tag not in existing:
-            try:
-                self.cur.execute("INSERT INTO tags(tag) VALUES(?);", (tag))
-                self.con.commit()
-            except Exception:
-                self.error("Cannot add tag '%s'" % tag)
+        return tag
+
+    def create_tag(self, tag):
+        """Create a new tag"""
+        tag = self._tag_name(tag)
+        try:
+            with self.transaction() as cur:
+                cur.execute("INSERT OR IGNORE INTO tags(tag) VALUES(?);", (tag,))
+        except sqlite.Error:
+            self.error("Cannot add tag '%s'" % tag)
+        self.tagIds = None
 
     def initialize(self):
-        """Initialize the database"""
+        """Initialize the database, with the base schema (see migrate())"""
+        self.begin(self.cur)
+        if self.cur.execute(
+            "SELECT 1 FROM sqlite_master WHERE name='version';"
+        ).fetchone():
+            # another process got here first
+            self.con.rollback()
+            return
         self.cur.execute("CREATE TABLE version(major, minor, subminor);")
         self.cur.execute(
             """INSERT INTO version(major, minor, subminor) VALUES (?,?,?);
             """,
-            (self.appversion[0], self.appversion[1], self.appversion[2]),
+            baseVersion,
         )
         self.cur.execute(
             """CREATE TABLE tags(
@@ -180,6 +1067,37 @@ class Diarydek:
         )
         self.con.commit()
 
+    def migrate(self):
+        """Bring the database schema up to date, by applying migrations"""
+        for version, description, steps in migrations:
+            if tuple(self.dbversion) >= version:
+                continue
+            self.fyi("migrating database to %d.%d.%d: %s" % (version + (description,)))
+            cur = self.con.cursor()
+            try:
+                self.begin(cur)
+                if tuple(cur.execute("SELECT * FROM version;").fetchone()) >= version:
+                    # another process got here first
+                    self.con.rollback()
+                    self.dbversion = version
+                    continue
+                for step in steps:
+                    if callable(step):
+                        step(self)
+                    else:
+                        cur.execute(step)
+                cur.execute(
+                    "UPDATE version SET major=?, minor=?, subminor=?;", version
+                )
+                self.con.commit()
+            except sqlite.Error as e:
+                self.con.rollback()
+                self.error(
+                    "cannot upgrade database '%s' to version %d.%d.%d (%s)"
+                    % ((self.db,) + version + (e,))
+                )
+            self.dbversion = version
+
     def list_all(self):
         """list all"""
         q = """
@@ -196,6 +1114,307 @@ class Diarydek:
         self.con.commit()
         return res  # list_all
 
+    def has_fts(self):
+        """Tell whether the database has a full-text index of entries"""
+        if self.fts is None:
+            self.fts = (
+                self.con.cursor()
+                .execute("SELECT 1 FROM sqlite_master WHERE name='entries_fts';")
+                .fetchone()
+                is not None
+            )
+        return self.fts
+
+    def create_fts(self):
+        """
+        Create (or rebuild) the full-text index of entries.  This is done
+        automatically when a database is created or upgraded, but is skipped
+        if the local SQLite lacks the FTS5 extension, in which case text
+        searches fall back to scanning entries.
+        """
+        cur = self.con.cursor()
+        try:
+            cur.execute("CREATE VIRTUAL TABLE temp.fts5_probe USING fts5(x);")
+            cur.execute("DROP TABLE temp.fts5_probe;")
+        except sqlite.OperationalError:
+            self.fyi("FTS5 is not available, so entries are not indexed")
+            self.fts = False
+            return False
+        for q in ftsSchema:
+            cur.execute(q)
+        self.fts = True
+        return True
+
+    def tag_bitmaps(self):
+        """
+        Return a dictionary mapping tag names to bitmaps of the IDs of their
+        entries (see tagquery.py), with None mapping to all entries.  This
+        is filled in by match_tags(), and emptied whenever the database is
+        changed, by this connection or another.
+        """
+        version = (
+            self.cur.execute("PRAGMA data_version;").fetchone()[0],
+            self.con.total_changes,
+        )
+        if version != self.tagBitmapsVersion:
+            self.tagBitmaps = {}
+            self.tagBitmapsVersion = version
+        return self.tagBitmaps
+
+    def match_tags(self, expression):
+        """
+        Return the sorted IDs of the entries matching a tag expression, such
+        as "work AND (meeting OR call) NOT draft" (see tagquery.py), raising
+        ValueError if it is malformed.  The expression is evaluated with
+        set operations on bitmaps of the entries of each tag, which are
+        cached until the database changes.
+        """
+        from .tagquery import parse, evaluate, to_bitmap, from_bitmap
+
+        tree = parse(expression)
+        cache = self.tag_bitmaps()
+        cur = self.con.cursor()
+
+        def bitmap(tag):
+            if tag not in cache:
+                tagId = self.tag_cache().get(tag)
+                rows = cur.execute(
+                    "SELECT entryId FROM entry_tags WHERE tagId = ?;",
+                    (tagId,),
+                )
+                cache[tag] = to_bitmap(row[0] for row in rows)
+            return cache[tag]
+
+        def universe():
+            if None not in cache:
+                count, first, last = cur.execute(
+                    "SELECT COUNT(*), MIN(entryId), MAX(entryId) FROM entries;"
+                ).fetchone()
+                if count and count == last - first + 1:
+                    # no gaps, as is usual, so the rows need not be read
+                    cache[None] = ((1 << count) - 1) << first
+                else:
+                    rows = cur.execute("SELECT entryId FROM entries;")
+                    cache[None] = to_bitmap(row[0] for row in rows)
+            return cache[None]
+
+        return from_bitmap(evaluate(tree, bitmap, universe))
+
+    def _filter(self, since=None, until=None, tag=None, text=None, match=None):
+        """
+        Return (join, conditions, params) for the SQL that restricts entries
+        (with alias 'e') as described in iter_entries().  'join' is empty
+        unless a full-text query is used, in which case it joins the FTS table
+        with alias 'f'.
+        """
+        conditions = []
+        params = []
+        join = ""
+        if since is not None:
+            conditions.append("e.epoch > ?")
+            params.append(to_epoch(since))
+        if until is not None:
+            conditions.append("e.epoch < ?")
+            params.append(to_epoch(until))
+        if tag:
+            from .tagquery import parse
+
+            tree = parse(tag)
+            if tree[0] == "tag":
+                conditions.append(
+                    """e.entryId IN (SELECT et.entryId FROM entry_tags et
+                    JOIN tags t ON et.tagId = +t.tagId WHERE t.tag = ?)"""
+                )
+                params.append(tree[1])
+            else:
+                ids = self.match_tags(tag)
+                conditions.append("e.entryId IN (SELECT value FROM json_each(?))")
+                params.append("[%s]" % ",".join(map(str, ids)))
+        if text and not self.has_fts():
+            for word in text.split():
+                conditions.append("instr(lower(e.entry), lower(?)) > 0")
+                params.append(word)
+            text = None
+        if text or match:
+            if not self.has_fts():
+                self.error("full-text queries need SQLite with the FTS5 extension")
+            query = [match] if match else []
+            if text:
+                query.extend('"%s"*' % word.replace('"', '""') for word in text.split())
+            query = " AND ".join("(%s)" % term for term in query)
+            try:
+                # a malformed query fails only when run, perhaps mid-listing
+                self.con.execute(
+                    "SELECT rowid FROM entries_fts WHERE entries_fts MATCH ? LIMIT 1;", (query,)
+                ).fetchall()
+            except sqlite.OperationalError as e:
+                self.error('cannot understand the full-text query "%s" (%s)' % (match, e))
+            join = "JOIN entries_fts f ON f.rowid = e.entryId"
+            conditions.append("entries_fts MATCH ?")
+            params.append(query)
+        return join, conditions, params
+
+    def iter_entries(
+        self, order="time", reverse=False, after=None, limit=None, **filters
+    ):
+        """
+        Yield entries as Entry tuples.  These may be restricted by keyword
+        arguments to those later than 'since' and earlier than 'until'
+        (datetimes, or strings as accepted by to_epoch()), having tags
+        matching 'tag', a tag name or an expression such as "work AND
+        (meeting OR call) NOT draft" (see match_tags()),
+        containing all the words in 'text' (or words starting with them), and
+        matching 'match', an FTS5 query that may use phrases, prefixes and
+        boolean operators.  Text searches ignore case.
+
+        Entries are in time order, or the reverse if 'reverse' is True, unless
+        'order' is "rank", in which case the best text matches come first.
+        In time order, 'after' may be the key (see page_entries()) of an
+        entry, to start just beyond it, and at most 'limit' entries are
+        yielded.  Entries whose times cannot be read (see epoch_sql()) come
+        after all others.  Rows are yielded as SQLite produces them, so
+        memory use does not depend on the size of the diary.
+        """
+        join, conditions, params = self._filter(**filters)
+        parts = [(None, [])]
+        if order == "rank" and join:
+            if after is not None:
+                self.error("cannot page through entries in order of rank")
+            order = "f.rank, e.epoch, e.entryId"
+        else:
+            if order == "rank":
+                self.warning("ranking needs a full-text query; ordering by time")
+            # These use the entries_epoch index, which also holds entryId,
+            # so that no sorting is needed, and 'after' is a range scan.
+            if reverse:
+                order = "e.epoch DESC NULLS FIRST, e.entryId DESC"
+            else:
+                order = "e.epoch NULLS LAST, e.entryId"
+            if after is not None:
+                parts = self._beyond(after, reverse)
+        cur = self.con.cursor()
+        for condition, extra in parts:
+            if limit is not None and limit <= 0:
+                break
+            where = conditions + [condition] if condition else conditions
+            where = "WHERE " + " AND ".join(where) if where else ""
+            q = entryQuery % {
+                "join": join,
+                "where": where,
+                "order": order if limit is None else order + " LIMIT %d" % limit,
+            }
+            self.fyi(q)
+            for row in cur.execute(q, params + extra):
+                tags = row[3].split(tagSeparator) if row[3] else []
+                yield Entry(row[0], row[1], row[2], tags, row[4])
+                if limit is not None:
+                    limit -= 1
+
+    def _beyond(self, after, reverse):
+        """
+        Return a list of (condition, params) selecting, in turn, the entries
+        beyond the key 'after' in time order (or reverse time order).  The
+        entries without epochs, which come last, are selected apart from
+        the others, so that each condition is a range of the entries_epoch
+        index.
+        """
+        epoch, entryId = after
+        if epoch is None:
+            if reverse:
+                return [("e.epoch IS NULL AND e.entryId < ?", [entryId]), ("e.epoch NOTNULL", [])]
+            return [("e.epoch IS NULL AND e.entryId > ?", [entryId])]
+        if reverse:
+            return [("(e.epoch, e.entryId) < (?, ?)", [epoch, entryId])]
+        return [("(e.epoch, e.entryId) > (?, ?)", [epoch, entryId]), ("e.epoch IS NULL", [])]
+
+    def page_entries(self, limit=20, after=None, reverse=False, **filters):
+        """
+        Return a page of at most 'limit' entries, in time order (or reverse
+        time order), as a list of Entry tuples, together with the key to
+        give as 'after' to get the next page, or None if there are no more.
+        The first page is got with 'after' being None.  Entries may be
+        restricted with the keyword arguments of iter_entries().  Each page
+        costs an index search plus a scan of 'limit' rows, however deep it is.
+        """
+        entries = list(
+            self.iter_entries(reverse=reverse, after=after, limit=limit, **filters)
+        )
+        key = None
+        if len(entries) == limit:
+            key = (entries[-1].epoch, entries[-1].entryId)
+        return entries, key
+
+    def write_csv(self, f, **filters):
+        """
+        Write entries to the text file 'f', in the CSV format read by
+        import_entries().  Each row holds the time, the entry, and its tags
+        separated by commas.  Entries are streamed from iter_entries(), and
+        may be narrowed with the same keyword arguments.
+        """
+        import csv
+
+        writer = csv.writer(f, quoting=csv.QUOTE_ALL, lineterminator="\n")
+        for entry in self.iter_entries(**filters):
+            writer.writerow((entry.time, entry.entry, ",".join(entry.tags)))
+
+    def to_columns(self, numpy=False, **filters):
+        """
+        Return the entries, in time order, as a dictionary of columns, for
+        analysis.  These take far less memory than Entry tuples:
+
+            "entryId"     array('q') of entry IDs
+            "epoch"       array('q') of times, as epochs (see epoch_sql()), or
+                          noEpoch for times that cannot be read
+            "tagOffsets"  array('q'), one longer than the above, in which
+                          the tags of entry i are those numbered from
+                          tagOffsets[i] up to (not including) tagOffsets[i+1]
+            "tagIds"      array('q') of those tag IDs, in order of linkage
+            "tags"        dictionary of tag names, by ID
+
+        The entries may be narrowed with the keyword arguments of
+        iter_entries().  If 'numpy' is True, the arrays are returned as NumPy
+        int64 arrays sharing their memory, so that no copies are made.
+        """
+        from array import array
+
+        join, conditions, params = self._filter(**filters)
+        q = """SELECT e.entryId, e.epoch, et.tagId FROM entries e %s
+        LEFT JOIN entry_tags et ON et.entryId = e.entryId
+        %s ORDER BY e.epoch NULLS LAST, e.entryId, et.entryTagId;""" % (
+            join,
+            "WHERE " + " AND ".join(conditions) if conditions else "",
+        )
+        columns = dict((name, array("q")) for name in ("entryId", "epoch", "tagOffsets", "tagIds"))
+        addEntry = columns["entryId"].append
+        addEpoch = columns["epoch"].append
+        addOffset = columns["tagOffsets"].append
+        tagIds = columns["tagIds"]
+        addTag = tagIds.append
+        last = None
+        began = not self.con.in_transaction
+        if began:
+            self.cur.execute("BEGIN")  # so that the tags match the links
+        try:
+            for entryId, epoch, tagId in self.cur.execute(q, params):
+                if entryId != last:
+                    addEntry(entryId)
+                    addEpoch(noEpoch if epoch is None else epoch)
+                    addOffset(len(tagIds))
+                    last = entryId
+                if tagId is not None:
+                    addTag(tagId)
+            addOffset(len(tagIds))
+            columns["tags"] = dict(self.cur.execute("SELECT tagId, tag FROM tags;"))
+        finally:
+            if began:
+                self.con.commit()
+        if numpy:
+            import numpy as np
+
+            for name in ("entryId", "epoch", "tagOffsets", "tagIds"):
+                columns[name] = np.frombuffer(columns[name], dtype=np.int64)
+        return columns
+
     def get_table(self, tablename):
         if tablename == "entries":
             res = self.cur.execute(
@@ -207,18 +1426,278 @@ class Diarydek:
         return res
 
     def get_tags_with_counts(self):
-        """Get tags, with counts."""
+        """Get tags, with counts, in alphabetical order."""
         q = """
-        SELECT tags.tag,count(tags.tag)
-        FROM tags
-        JOIN entry_tags
-        ON tags.tagId = entry_tags.tagId
-        GROUP BY tags.tagId, entry_tags.tagId
+        SELECT tags.tag, tag_counts.count
+        FROM tag_counts
+        JOIN tags ON tags.tagId = tag_counts.tagId
+        ORDER BY tags.tag;
         """
-        res = self.cur.execute(q).fetchall()
-        res = sorted(res, key=lambda res: res[0])
-        self.con.commit()
-        return res
+        return self.cur.execute(q).fetchall()
+
+    def get_period_counts(self, period="month"):
+        """
+        Return a list of (bucket, count) giving the number of entries in each
+        "day", "week" or "month", in time order.  Buckets are written as
+        yyyy-mm-dd, yyyy-Www (weeks starting on Monday) and yyyy-mm.
+        """
+        if period not in periods:
+            self.error("period must be one of: %s" % ", ".join(periods))
+        q = "SELECT bucket, count FROM period_counts WHERE period=? ORDER BY bucket;"
+        return self.cur.execute(q, (period,)).fetchall()
+
+    def get_tag_pairs(self, limit=10):
+        """
+        Return a list of (tag, tag, count) for the pairs of tags that most
+        often appear together on entries.
+        """
+        q = """
+        SELECT a.tag, b.tag, p.count
+        FROM tag_pairs p
+        JOIN tags a ON a.tagId = p.tagA
+        JOIN tags b ON b.tagId = p.tagB
+        ORDER BY p.count DESC, a.tag, b.tag
+        LIMIT ?;
+        """
+        return self.cur.execute(q, (limit,)).fetchall()
+
+    def create_changes(self, journal=True):
+        """
+        Create the journal of changes, with its triggers.  If 'journal' is
+        True, the existing entries are recorded as added, so that exporting
+        all changes (since sequence number 0) exports the whole diary.
+        """
+        cur = self.con.cursor()
+        for q in changesSchema:
+            cur.execute(q)
+        if journal:
+            cur.execute(
+                """INSERT INTO changes(op, entryId)
+                SELECT 'add', entryId FROM entries ORDER BY epoch, entryId;"""
+            )
+
+    def iter_changes(self, since=0):
+        """
+        Yield the changes made after sequence number 'since', as dictionaries
+        with items "seq" and "op", and then
+
+            "add": "time", "entry" and "tags" (a list of names)
+            "delete", "tag" and "untag": "time" and "entry", identifying the
+                entry, and for the latter two, "tag"
+            "rename": "old" and "tag", the old and new names
+
+        Changes that later ones make moot are left out: entries added and
+        deleted after 'since' are not mentioned, and entries added after
+        'since' are given with their present tags.  The last item is
+        {"op": "end", "seq": N}, where N is the number to give as 'since'
+        the next time.  The journal is read in one transaction, so that it
+        is consistent with the entries.
+        """
+        cur = self.con.cursor()
+        lookup = self.con.cursor()
+        entry = entryQuery % dict(join="", where="WHERE e.entryId = ?", order="e.entryId")
+        began = not self.con.in_transaction
+        if began:
+            cur.execute("BEGIN;")
+        try:
+            last = cur.execute("SELECT IFNULL(MAX(seq), 0) FROM changes;").fetchone()[0]
+            added = set()
+            deleted = set()
+            for op, entryId in cur.execute(
+                """SELECT op, entryId FROM changes
+                WHERE seq > ? AND seq <= ? AND op IN ('add', 'delete');""",
+                (since, last),
+            ):
+                (added if op == "add" else deleted).add(entryId)
+            rows = cur.execute(
+                """SELECT seq, op, entryId, time, entry, tag, old FROM changes
+                WHERE seq > ? AND seq <= ? ORDER BY seq;""",
+                (since, last),
+            )
+            for seq, op, entryId, time, text, tag, old in rows:
+                if op == "add":
+                    if entryId in deleted:
+                        continue
+                    row = lookup.execute(entry, (entryId,)).fetchone()
+                    tags = row[3].split(tagSeparator) if row[3] else []
+                    yield dict(seq=seq, op=op, time=row[1], entry=row[2], tags=tags)
+                elif op == "delete":
+                    if entryId not in added:
+                        yield dict(seq=seq, op=op, time=time, entry=text)
+                elif op in ("tag", "untag"):
+                    if entryId in added or entryId in deleted:
+                        continue
+                    row = lookup.execute(
+                        "SELECT time, entry FROM entries WHERE entryId = ?;", (entryId,)
+                    ).fetchone()
+                    if row:  # else a link of an entry deleted before 'since'
+                        yield dict(seq=seq, op=op, time=row[0], entry=row[1], tag=tag)
+                elif op == "rename":
+                    yield dict(seq=seq, op=op, old=old, tag=tag)
+            yield dict(op="end", seq=last)
+        finally:
+            if began:
+                self.con.commit()
+
+    def apply_changes(self, changes):
+        """
+        Apply changes, as exported by iter_changes() from another diary, in
+        one transaction.  Entries are identified by their time and text.
+        Changes that are already in place, such as adding an entry that
+        (with its tags) is already present, are skipped, so applying the
+        same changes twice is harmless.  Returns the number of changes
+        that altered the diary.
+        """
+        count = 0
+        with self.transaction() as cur:
+
+            def find(change):
+                row = cur.execute(
+                    "SELECT entryId FROM entries WHERE time = ? AND entry = ? ORDER BY entryId;",
+                    (change["time"], change["entry"]),
+                ).fetchone()
+                return row[0] if row else None
+
+            for change in changes:
+                op = change.get("op")
+                if op == "add":
+                    tags = list(dict.fromkeys(change.get("tags", [])))
+                    params = (change["time"], change["entry"], tagSeparator.join(tags))
+                    if cur.execute(findDuplicate, params).fetchone():
+                        continue
+                    cur.execute(insertEntry, params)
+                    entryId = cur.lastrowid
+                    cur.executemany(
+                        "INSERT INTO entry_tags(entryId,tagId) VALUES(?,?);",
+                        [(entryId, tagId) for tagId in self.tag_ids(tags)],
+                    )
+                elif op == "delete":
+                    entryId = find(change)
+                    if entryId is None:
+                        continue
+                    cur.execute("DELETE FROM entry_tags WHERE entryId = ?;", (entryId,))
+                    cur.execute("DELETE FROM entries WHERE entryId = ?;", (entryId,))
+                elif op in ("tag", "untag"):
+                    entryId = find(change)
+                    if entryId is None:
+                        continue
+                    tagId = self.tag_ids([change["tag"]])[0]
+                    linked = cur.execute(
+                        "SELECT 1 FROM entry_tags WHERE entryId = ? AND tagId = ?;",
+                        (entryId, tagId),
+                    ).fetchone()
+                    if op == "tag" and not linked:
+                        cur.execute(
+                            "INSERT INTO entry_tags(entryId,tagId) VALUES(?,?);", (entryId, tagId)
+                        )
+                    elif op == "untag" and linked:
+                        cur.execute(
+                            "DELETE FROM entry_tags WHERE entryId = ? AND tagId = ?;",
+                            (entryId, tagId),
+                        )
+                    else:
+                        continue
+                    cur.execute(updateHashes + " WHERE entryId = ?;", (entryId,))
+                elif op == "rename":
+                    if not self._rename(cur, change["old"], change["tag"]):
+                        continue
+                elif op == "end":
+                    continue
+                else:
+                    raise ValueError("unknown change %r" % op)
+                count += 1
+        self.tagIds = None
+        return count
+
+    def _rename(self, cur, old, new):
+        """
+        Rename tag 'old' as 'new' within a transaction, merging it into 'new'
+        if that exists, and returning False if there is no tag 'old'.
+        """
+        oldId = cur.execute("SELECT tagId FROM tags WHERE tag = ?;", (old,)).fetchone()
+        if not oldId or old == new:
+            return False
+        newId = cur.execute("SELECT tagId FROM tags WHERE tag = ?;", (new,)).fetchone()
+        if newId:
+            cur.execute(
+                """UPDATE entry_tags SET tagId = ?1 WHERE tagId = ?2 AND entryId NOT IN
+                (SELECT entryId FROM entry_tags WHERE tagId = ?1);""",
+                (newId[0], oldId[0]),
+            )
+            cur.execute("DELETE FROM entry_tags WHERE tagId = ?;", (oldId[0],))
+            cur.execute("DELETE FROM tags WHERE tagId = ?;", (oldId[0],))
+        else:
+            cur.execute("UPDATE tags SET tag = ? WHERE tagId = ?;", (new, oldId[0]))
+        cur.execute(
+            updateHashes
+            + " WHERE entryId IN (SELECT et.entryId FROM entry_tags et"
+            " JOIN tags t ON t.tagId = et.tagId WHERE t.tag = ?);",
+            (new,),
+        )
+        self.tagIds = None
+        return True
+
+    def create_stats(self, fill=True):
+        """
+        Create the statistics tables and triggers, and, if 'fill' is True,
+        fill the tables.
+        """
+        cur = self.con.cursor()
+        for q in statsSchema:
+            cur.execute(q)
+        if fill:
+            self._fill_stats(cur)
+
+    def rebuild_stats(self):
+        """
+        Recompute the statistics tables from scratch.  They are kept up to
+        date as the diary changes, so this is only needed for repairs, e.g.
+        after the database was altered by another program.
+        """
+        with self.transaction() as cur:
+            for q in statsSchema + lastUsedSchema:
+                cur.execute(q)
+            self._fill_stats(cur)
+            self._fill_last_used(cur)
+
+    def create_last_used(self):
+        """Create the triggers that maintain tag_counts.lastUsed, and fill it"""
+        cur = self.con.cursor()
+        for q in lastUsedSchema:
+            cur.execute(q)
+        self._fill_last_used(cur)
+
+    def _fill_last_used(self, cur):
+        cur.execute(
+            """UPDATE tag_counts SET lastUsed = (
+                SELECT MAX(e.epoch) FROM entry_tags et
+                JOIN entries e ON e.entryId = et.entryId
+                WHERE et.tagId = tag_counts.tagId);"""
+        )
+
+    def _fill_stats(self, cur):
+        cur.execute("DELETE FROM tag_counts;")
+        cur.execute("DELETE FROM period_counts;")
+        cur.execute("DELETE FROM tag_pairs;")
+        cur.execute(
+            """INSERT INTO tag_counts(tagId, count)
+            SELECT tagId, COUNT(*) FROM entry_tags GROUP BY tagId;"""
+        )
+        for period in periods:
+            cur.execute(
+                """INSERT INTO period_counts(period, bucket, count)
+                SELECT ?, %s AS b, COUNT(*) FROM entries
+                WHERE epoch IS NOT NULL GROUP BY b;"""
+                % _bucket("epoch", period),
+                (period,),
+            )
+        cur.execute(
+            """INSERT INTO tag_pairs(tagA, tagB, count)
+            SELECT a.tagId, b.tagId, COUNT(*)
+            FROM entry_tags a
+            JOIN entry_tags b ON b.entryId = a.entryId AND b.tagId > a.tagId
+            GROUP BY a.tagId, b.tagId;"""
+        )
 
     def list_tags(self):
         """Return alphabetized list of tags"""
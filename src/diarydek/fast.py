@@ -0,0 +1,93 @@
+#!/usr/bin/python3
+"""
+Fast handling of the most common commands.
+
+Most invocations of diarydek either add an entry, complete a tag name or
+show the version, and they are often run from shell prompts, completion
+functions and editor hooks, so start-up time matters.  dispatch() handles
+those cases without building the argument parser, and without importing
+anything that is not needed; everything else is left to cli.mainer().
+The start-up cost is tracked by benchmarks/startup.py.
+"""
+
+import sys
+from .config import appversion, defaultDatabase, separator
+
+
+def dispatch(argv):
+    """
+    Handle the command-line arguments in 'argv' (excluding the program name),
+    if they ask for the version, add an entry or complete a tag name
+    (optionally with the --database and --concurrent options).  Returns
+    False if they do anything else.
+    """
+    if argv == ["--version"]:
+        print("diary version %d.%d.%d" % tuple(appversion))
+        return True
+    databases = []
+    concurrent = False
+    prefix = None
+    words = []
+    i = 0
+    while i < len(argv):
+        arg = argv[i]
+        if arg == "--database" and i + 1 < len(argv):
+            databases.append(argv[i + 1])
+            i += 2
+            continue
+        if arg.startswith("--database="):
+            databases.append(arg[len("--database=") :])
+        elif arg == "--concurrent":
+            concurrent = True
+        elif arg in ("--completeTags", "--complete-tags") and i + 1 < len(argv):
+            prefix = argv[i + 1]
+            i += 1
+        elif arg.startswith("-"):
+            return False
+        else:
+            words.append(arg)
+        i += 1
+    if len(databases) > 1:
+        return False  # let mainer() explain
+    database = databases[0] if databases else defaultDatabase
+    if any(c in database for c in "*?["):
+        return False  # a pattern, which mainer() expands
+    if prefix is not None:
+        if words:
+            return False  # let mainer() explain
+        from .complete import print_completions
+
+        print_completions(database, prefix)
+        return True
+    if separator in words:
+        start = words.index(separator) + 1
+        tags = words[start:]
+        entry = " ".join(words[0 : start - 1])
+    else:
+        entry = " ".join(words)
+        tags = []
+    if not entry:
+        return False  # let mainer() explain
+    import datetime
+    from .client import request, ServerError
+
+    time = datetime.datetime.now()
+    # hand the work to a server, if one is running (see server.py)
+    try:
+        replies = request(
+            database, {"op": "add", "time": str(time), "entry": entry, "tags": tags}
+        )
+        if replies is not None:
+            list(replies)
+            return True
+    except ServerError as e:
+        print("Error: %s" % e, file=sys.stderr)
+        sys.exit(1)
+    from .diarydek import Diarydek
+
+    Diarydek(db=database, concurrent=concurrent).add_entry(time, entry, tags)
+    return True
+
+
+if __name__ == "__main__":
+    dispatch(sys.argv[1:])
@@ -0,0 +1,132 @@
+#!/usr/bin/python3
+"""
+Searching several diarydek databases at once, as used by
+'diarydek --database work.db --database home.db --list'.
+
+Each database is read by a thread of its own, with its own connection,
+which passes entries in chunks through a bounded queue.  The streams are
+merged lazily in time order (by epoch, then entry ID), so the first entries
+appear as soon as every database has produced some, and memory use does
+not depend on the sizes of the diaries.  Each entry is labelled with the
+name of its database (see labels()).
+"""
+
+import csv
+import heapq
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from queue import Queue, Full
+
+from .diarydek import Diarydek
+
+
+def labels(databases):
+    """
+    Return the labels of a list of databases: their file names without
+    extensions, or, where two share a name, as many of the directories
+    above as tell them apart, e.g. "work/diary" and "home/diary".
+    """
+    paths = [
+        os.path.splitext(os.path.abspath(os.path.expanduser(db)))[0].split(os.sep)
+        for db in databases
+    ]
+    result = []
+    for path in paths:
+        n = 1
+        while n < len(path) and any(
+            other is not path and other[-n:] == path[-n:] for other in paths
+        ):
+            n += 1
+        result.append("/".join(path[-n:]))
+    return result
+
+
+def _put(queue, stop, item):
+    """Put item on queue, unless 'stop' is set first; returns whether it was put"""
+    while not stop.is_set():
+        try:
+            queue.put(item, timeout=0.1)
+            return True
+        except Full:
+            pass
+    return False
+
+
+def _produce(db, queue, stop, chunk, debug, filters):
+    """Put chunks of the entries of 'db' on queue, then None (or an exception)"""
+    diary = None
+    try:
+        diary = Diarydek(db=db, debug=debug)
+        batch = []
+        for entry in diary.iter_entries(**filters):
+            batch.append(entry)
+            if len(batch) >= chunk:
+                if not _put(queue, stop, batch):
+                    return
+                batch = []
+        if batch:
+            _put(queue, stop, batch)
+        _put(queue, stop, None)
+    except BaseException as e:  # including SystemExit, from Diarydek.error()
+        _put(queue, stop, e)
+    finally:
+        if diary is not None:
+            diary.con.close()
+
+
+def _consume(queue, source):
+    """Yield (source, entry) items from the chunks on queue, until None"""
+    while True:
+        item = queue.get()
+        if item is None:
+            return
+        if isinstance(item, BaseException):
+            raise item
+        for entry in item:
+            yield (source, entry)
+
+
+def iter_many(databases, order="time", reverse=False, limit=None, chunk=256, debug=0, **filters):
+    """
+    Yield (label, entry) items for the entries of several databases, in
+    time order, or the reverse if 'reverse' is True, stopping after
+    'limit' entries if it is given.  The entries may be narrowed by the
+    keyword arguments of Diarydek.iter_entries().  Ranking by text match
+    (order="rank") is not possible across databases.
+    """
+    if order != "time":
+        raise ValueError("entries from several databases can only be in time order")
+    missing = [db for db in databases if not os.path.exists(os.path.expanduser(db))]
+    if missing:
+        raise ValueError("no database named '%s'" % missing[0])
+    stop = threading.Event()
+    queues = [Queue(maxsize=4) for db in databases]
+    pool = ThreadPoolExecutor(len(databases))  # one each, so none waits for another
+    try:
+        for db, queue in zip(databases, queues):
+            pool.submit(
+                _produce, db, queue, stop, chunk, debug, dict(filters, reverse=reverse, limit=limit)
+            )
+        merged = heapq.merge(
+            *[_consume(queue, name) for name, queue in zip(labels(databases), queues)],
+            # entries without epochs come last, as in Diarydek.iter_entries()
+            key=lambda item: (item[1].epoch is None, item[1].epoch or 0, item[1].entryId),
+            reverse=reverse
+        )
+        yield from islice(merged, limit)
+    finally:
+        stop.set()
+        pool.shutdown(wait=True)
+
+
+def write_csv(f, databases, **filters):
+    """
+    Write the entries of several databases to the text file 'f', as for
+    Diarydek.write_csv(), in time order, with a fourth column giving the
+    label of the database of each.
+    """
+    writer = csv.writer(f, quoting=csv.QUOTE_ALL, lineterminator="\n")
+    for source, entry in iter_many(databases, **filters):
+        writer.writerow((entry.time, entry.entry, ",".join(entry.tags), source))
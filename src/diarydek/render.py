@@ -0,0 +1,95 @@
+#!/usr/bin/python3
+"""
+Output of entries, as used by 'diarydek --list --format text|tsv|jsonl'.
+
+Each format is a function in 'renderers', which turns one entry (with the
+label of its database, or None) into a line of text.  write_entries() feeds
+entries to one of them as the query yields them, and writes the lines in
+chunks, so that the cost of output does not dominate when a large diary is
+piped to another program.  If that program exits early, as 'head' and
+pagers do, writing stops quietly.
+
+    text   the time, entry and tags, for reading
+    tsv    tab-separated ID, time, entry and tags (joined by commas), and
+           the database label if there is one; tabs, newlines and
+           backslashes in entries are written as \\t, \\n and \\\\
+    jsonl  one JSON object per line, with items "entryId", "time", "epoch",
+           "entry", "tags" (a list) and, if labelled, "database"
+"""
+
+import json
+import os
+import sys
+
+
+def render_text(entry, showID=False, label=None):
+    line = "%.19s %s" % (entry.time, entry.entry)
+    if entry.tags:
+        line += " : " + " ".join(entry.tags) + " "
+    if showID:
+        line = "<%d> %s" % (entry.entryId, line)
+    if label is not None:
+        line = "[%s] %s" % (label, line)
+    return line + "\n"
+
+
+tsvEscapes = str.maketrans({"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r"})
+
+
+def render_tsv(entry, showID=False, label=None):
+    fields = [str(entry.entryId), entry.time, entry.entry, ",".join(entry.tags)]
+    if label is not None:
+        fields.append(label)
+    return "\t".join(field.translate(tsvEscapes) for field in fields) + "\n"
+
+
+def render_jsonl(entry, showID=False, label=None):
+    item = {
+        "entryId": entry.entryId,
+        "time": entry.time,
+        "epoch": entry.epoch,
+        "entry": entry.entry,
+        "tags": entry.tags,
+    }
+    if label is not None:
+        item["database"] = label
+    return json.dumps(item, ensure_ascii=False) + "\n"
+
+
+renderers = {"text": render_text, "tsv": render_tsv, "jsonl": render_jsonl}
+
+
+def write_entries(entries, format="text", showID=False, labelled=False, file=None, chunk=1000):
+    """
+    Write entries to 'file' (by default, standard output) in a format named
+    in 'renderers', 'chunk' lines at a time.  If 'labelled' is True, the
+    items are (label, entry) tuples, as from multi.iter_many().  The ID is
+    shown in text only if 'showID' is True; the other formats always give
+    it.  If standard output is a pipe that the reader has closed, the
+    process exits with the status it would have if killed by SIGPIPE.
+    """
+    if file is None:
+        file = sys.stdout
+    render = renderers[format]
+    lines = []
+    try:
+        try:
+            for item in entries:
+                if labelled:
+                    lines.append(render(item[1], showID, item[0]))
+                else:
+                    lines.append(render(item, showID))
+                if len(lines) >= chunk:
+                    file.write("".join(lines))
+                    lines = []
+        finally:
+            # including the entries before an error, e.g. from a server
+            file.write("".join(lines))
+            file.flush()
+    except BrokenPipeError:
+        if file is not sys.stdout:
+            raise
+        # Python would complain again at exit, on flushing stdout
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, sys.stdout.fileno())
+        sys.exit(128 + 13)
@@ -0,0 +1,209 @@
+#!/usr/bin/python3
+"""
+A resident diarydek server, as started by 'diarydek --serve'.
+
+The server keeps connections to one database open, with warm caches, and
+listens on a Unix socket (see client.socket_path()).  While it runs, the
+command-line tool hands it the work of adding and listing entries, which
+saves the cost of starting up and opening the database on every call.
+
+Each request is one line of JSON, and each reply is a series of lines of
+JSON ending with {"end": true}, or a line with an "error" item.  Requests:
+
+    {"op": "add", "time": "...", "entry": "...", "tags": [...]}
+        adds an entry, replying {"entryId": id}
+    {"op": "list", "filters": {...}, "reverse": false, "limit": null,
+     "tail": null, "order": "time"}
+        lists entries, as described for Diarydek.iter_entries(), replying
+        with one {"entry": [entryId, time, entry, tags, epoch]} per entry
+    {"op": "ping"}
+        replies {"version": [major, minor, subminor]}
+
+Writes are done one at a time, in the order received, on a single
+connection.  Reads run concurrently, each thread having its own connection,
+and send their replies in chunks as the query yields them, so that listing
+a large diary needs little memory.
+"""
+
+import asyncio
+import json
+import os
+import signal
+import socket
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from .client import private, socket_path
+from .config import appversion
+from .diarydek import Diarydek
+
+
+class ServedDiarydek(Diarydek):
+    """A Diarydek whose errors go to the client, rather than ending the server"""
+
+    def error(self, msg, level=1, prefix="Error: "):
+        raise ValueError(msg)
+
+
+class Server:
+    def __init__(self, db, concurrent=False, readers=4, debug=0):
+        """
+        A server for the database 'db', reading with up to 'readers' threads.
+        """
+        self.db = db
+        self.concurrent = concurrent
+        self.debug = debug
+        self.writer = ThreadPoolExecutor(1)
+        self.readers = ThreadPoolExecutor(readers)
+        self.local = threading.local()
+
+    def diary(self):
+        """Return the Diarydek object of the current thread"""
+        diary = getattr(self.local, "diary", None)
+        if diary is None:
+            diary = ServedDiarydek(db=self.db, debug=self.debug, concurrent=self.concurrent)
+            self.local.diary = diary
+        return diary
+
+    def add(self, message):
+        entryId = self.diary().add_entry(message["time"], message["entry"], message["tags"])
+        return [{"entryId": entryId}]
+
+    def list(self, message, send, chunk=500):
+        """
+        List entries, passing the lines of the replies to send() 'chunk' at a
+        time, and stopping if it returns False
+        """
+        diary = self.diary()
+        filters = message.get("filters", {})
+        if message.get("tail") is not None:
+            entries = list(diary.iter_entries(reverse=True, limit=message["tail"], **filters))
+            if not message.get("reverse"):
+                entries.reverse()
+        else:
+            entries = diary.iter_entries(
+                order=message.get("order", "time"),
+                reverse=message.get("reverse", False),
+                limit=message.get("limit"),
+                **filters
+            )
+        lines = []
+        for entry in entries:
+            lines.append(json.dumps({"entry": list(entry)}) + "\n")
+            if len(lines) >= chunk:
+                if not send("".join(lines)):
+                    return
+                lines = []
+        send("".join(lines))
+
+    def stream(self, message, queue, loop, gone):
+        """
+        Run list() in a reader thread, putting chunks of lines on 'queue',
+        then None.  Waiting while the queue is full keeps a slow client from
+        making the server hold the whole list.
+        """
+
+        def send(text):
+            asyncio.run_coroutine_threadsafe(queue.put(text), loop).result()
+            return not gone.is_set()
+
+        try:
+            self.list(message, send)
+        except Exception as e:
+            send(json.dumps({"error": str(e) or "failed; see the server's output"}) + "\n")
+        finally:
+            send(None)
+
+    async def handle(self, reader, writer):
+        """Answer one request"""
+        loop = asyncio.get_running_loop()
+        gone = threading.Event()
+        replies = []
+        try:
+            message = json.loads(await reader.readline())
+            op = message.get("op")
+            if op == "add":
+                replies = await loop.run_in_executor(self.writer, self.add, message)
+            elif op == "list":
+                queue = asyncio.Queue(4)
+                task = loop.run_in_executor(
+                    self.readers, self.stream, message, queue, loop, gone
+                )
+                while True:
+                    text = await queue.get()
+                    if text is None:
+                        break
+                    if not gone.is_set():
+                        try:
+                            writer.write(text.encode())
+                            await writer.drain()
+                        except ConnectionError:
+                            gone.set()  # the client went away; let the thread finish
+                await task
+            elif op == "ping":
+                replies = [{"version": appversion}]
+            else:
+                replies = [{"error": "unknown request %r" % op}]
+        except Exception as e:
+            replies = [{"error": str(e) or "failed; see the server's output"}]
+        if not gone.is_set():
+            try:
+                for reply in replies:
+                    writer.write((json.dumps(reply) + "\n").encode())
+                writer.write(b'{"end": true}\n')
+                await writer.drain()
+            except ConnectionError:
+                pass  # the client went away
+        writer.close()
+
+    async def run(self, path):
+        """Serve on socket 'path' until interrupted"""
+        loop = asyncio.get_running_loop()
+        # open the database, applying any migrations, before listening
+        await loop.run_in_executor(self.writer, self.diary)
+        server = await asyncio.start_unix_server(self.handle, path)
+        os.chmod(path, 0o600)
+        stop = loop.create_future()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, stop.set_result, None)
+        print("diarydek: serving '%s' on %s" % (self.db, path), file=sys.stderr)
+        async with server:
+            await stop
+
+
+def serve(db, concurrent=False, readers=4, debug=0):
+    """Run a server for database 'db', until interrupted"""
+    db = os.path.abspath(os.path.expanduser(db))
+    path = socket_path(db)
+    directory = os.path.dirname(path)
+    try:
+        os.mkdir(directory, 0o700)
+    except FileExistsError:
+        pass
+    if not private(directory):
+        print(
+            "Error: %s must be a directory of yours, closed to others (mode 0700)" % directory,
+            file=sys.stderr,
+        )
+        sys.exit(1)
+    if os.path.exists(path):
+        s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            s.connect(path)
+            s.close()
+            print("Error: a server is already running on %s" % path, file=sys.stderr)
+            sys.exit(1)
+        except OSError:
+            os.remove(path)  # left behind by a server that has stopped
+    server = Server(db, concurrent=concurrent, readers=readers, debug=debug)
+    try:
+        asyncio.run(server.run(path))
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+        try:
+            os.rmdir(directory)
+        except OSError:
+            pass  # in use by the server of another database
+        server.writer.shutdown()
+        server.readers.shutdown()
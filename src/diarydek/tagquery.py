@@ -0,0 +1,130 @@
+#!/usr/bin/python3
+"""
+Boolean tag expressions, as used by 'diarydek --list : work AND (meeting OR call) NOT draft'.
+
+An expression is made of tag names, the operators AND, OR and NOT (in
+capitals), and parentheses.  Tags written side by side must all be present,
+as if joined by AND, and NOT binds more tightly than AND, which binds more
+tightly than OR.  parse() turns an expression into a tree of tuples:
+
+    ("tag", name)
+    ("not", tree)
+    ("and", tree, tree, ...)
+    ("or", tree, tree, ...)
+
+and evaluate() finds the matching entries, given sets of entries as
+bitmaps, i.e. Python integers whose bit N is set if entry N is in the set.
+Set operations on these take time proportional to the number of entries
+divided by the word size, however many rows match.
+"""
+
+import re
+
+operators = ("AND", "OR", "NOT")
+
+
+def tokenize(text):
+    """Split an expression into tag names, operators and parentheses"""
+    return re.findall(r"[()]|[^\s()]+", text)
+
+
+def parse(text):
+    """
+    Return the tree (see above) for an expression, raising ValueError if it
+    is malformed.  A list of words is taken as their expression, joined by
+    spaces.
+    """
+    if not isinstance(text, str):
+        text = " ".join(text)
+    tokens = tokenize(text)
+    if not tokens:
+        raise ValueError("empty tag expression")
+    position = 0
+
+    def peek():
+        return tokens[position] if position < len(tokens) else None
+
+    def take():
+        nonlocal position
+        position += 1
+        return tokens[position - 1]
+
+    def disjunction():
+        terms = [conjunction()]
+        while peek() == "OR":
+            take()
+            terms.append(conjunction())
+        return terms[0] if len(terms) == 1 else ("or",) + tuple(terms)
+
+    def conjunction():
+        terms = [negation()]
+        while peek() is not None and peek() not in ("OR", ")"):
+            if peek() == "AND":
+                take()
+            terms.append(negation())
+        return terms[0] if len(terms) == 1 else ("and",) + tuple(terms)
+
+    def negation():
+        if peek() == "NOT":
+            take()
+            return ("not", negation())
+        return atom()
+
+    def atom():
+        token = peek()
+        if token is None:
+            raise ValueError("tag expression '%s' ends too soon" % text)
+        take()
+        if token == "(":
+            tree = disjunction()
+            if peek() != ")":
+                raise ValueError("missing ')' in tag expression '%s'" % text)
+            take()
+            return tree
+        if token == ")" or token in operators:
+            raise ValueError("unexpected '%s' in tag expression '%s'" % (token, text))
+        return ("tag", token)
+
+    tree = disjunction()
+    if position < len(tokens):
+        raise ValueError("unexpected '%s' in tag expression '%s'" % (peek(), text))
+    return tree
+
+
+def evaluate(tree, bitmap, universe):
+    """
+    Return the bitmap of the entries matching a tree, given functions that
+    return the bitmap for a tag name, and the bitmap of all entries (which
+    is only needed for NOT).
+    """
+    kind = tree[0]
+    if kind == "tag":
+        return bitmap(tree[1])
+    if kind == "not":
+        return universe() & ~evaluate(tree[1], bitmap, universe)
+    result = evaluate(tree[1], bitmap, universe)
+    for subtree in tree[2:]:
+        if kind == "and":
+            if not result:
+                break
+            result &= evaluate(subtree, bitmap, universe)
+        else:
+            result |= evaluate(subtree, bitmap, universe)
+    return result
+
+
+def to_bitmap(ids):
+    """Return the bitmap for an iterable of non-negative integers"""
+    bits = bytearray()
+    for i in ids:
+        byte = i >> 3
+        if byte >= len(bits):
+            bits.extend(bytes(byte - len(bits) + 1))
+        bits[byte] |= 1 << (i & 7)
+    return int.from_bytes(bits, "little")
+
+
+def from_bitmap(bitmap):
+    """Return the sorted list of the integers in a bitmap"""
+    digits = bin(bitmap)[:1:-1]  # least significant first
+    return [match.start() for match in re.finditer("1", digits)]
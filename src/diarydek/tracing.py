@@ -0,0 +1,194 @@
+#!/usr/bin/python3
+"""
+Profiling of diarydek, as used by 'diarydek --profile'.
+
+A Profiler records every SQL statement that Diarydek runs, with the number
+of calls, the rows returned and the time taken (including the time spent
+fetching rows), along with the number of commits, and the time spent in
+named phases of the work.  To use it from Python, pass one to Diarydek:
+
+    profiler = Profiler()
+    diary = Diarydek(db="~/diary.db", profiler=profiler)
+    with profiler.phase("report"):
+        ...
+    profiler.summary()
+"""
+
+from __future__ import print_function
+import sys
+import json
+import sqlite3 as sqlite
+from contextlib import contextmanager
+from time import perf_counter as timer
+
+
+class ProfilingCursor(sqlite.Cursor):
+    """A cursor that reports statements, rows and times to a Profiler"""
+
+    def execute(self, sql, parameters=()):
+        self.event = self.connection.profiler.start(sql)
+        start = timer()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self.event["seconds"] += timer() - start
+
+    def executemany(self, sql, parameters):
+        self.event = self.connection.profiler.start(sql)
+        start = timer()
+        try:
+            return super().executemany(sql, parameters)
+        finally:
+            self.event["seconds"] += timer() - start
+
+    def _fetched(self, start, rows):
+        self.event["seconds"] += timer() - start
+        self.event["rows"] += rows
+
+    def fetchone(self):
+        start = timer()
+        row = super().fetchone()
+        self._fetched(start, row is not None)
+        return row
+
+    def fetchmany(self, size=None):
+        start = timer()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._fetched(start, len(rows))
+        return rows
+
+    def fetchall(self):
+        start = timer()
+        rows = super().fetchall()
+        self._fetched(start, len(rows))
+        return rows
+
+    def __next__(self):
+        start = timer()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self._fetched(start, 0)
+            raise
+        self._fetched(start, 1)
+        return row
+
+
+class ProfilingConnection(sqlite.Connection):
+    """A connection whose cursors, and commits, are profiled"""
+
+    profiler = None
+
+    def cursor(self, factory=ProfilingCursor):
+        return super().cursor(factory)
+
+    def commit(self):
+        start = timer()
+        super().commit()
+        self.profiler.committed(timer() - start)
+
+
+class Profiler:
+    def __init__(self):
+        """
+        A record of the SQL statements and phases of a diarydek run.
+        """
+        self.origin = timer()
+        self.events = []  # one per statement execution, in order
+        self.phases = {}  # name: seconds
+        self.commits = 0
+        self.commitSeconds = 0.0
+        self.executed = 0  # statements run by SQLite, including in triggers
+
+    def connect(self, db, **kwargs):
+        """Open a profiled connection to a database"""
+        con = sqlite.connect(db, factory=ProfilingConnection, **kwargs)
+        con.profiler = self
+        con.set_trace_callback(self.traced)
+        return con
+
+    def traced(self, sql):
+        self.executed += 1
+
+    def start(self, sql):
+        """Record the start of a statement, returning its event"""
+        event = {
+            "sql": " ".join(sql.split()),
+            "start": timer() - self.origin,
+            "seconds": 0.0,
+            "rows": 0,
+        }
+        self.events.append(event)
+        return event
+
+    def committed(self, seconds):
+        self.commits += 1
+        self.commitSeconds += seconds
+
+    def add(self, name, seconds):
+        """Add time to a named phase"""
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    @contextmanager
+    def phase(self, name):
+        """Context manager that adds the time of its block to a named phase"""
+        start = timer()
+        try:
+            yield
+        finally:
+            self.add(name, timer() - start)
+
+    def iterate(self, iterable, name):
+        """Yield from iterable, adding the time taken by each item to a phase"""
+        iterator = iter(iterable)
+        while True:
+            start = timer()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add(name, timer() - start)
+                return
+            self.add(name, timer() - start)
+            yield item
+
+    def statements(self):
+        """Return a list of [sql, calls, rows, seconds], slowest first"""
+        bySql = {}
+        for event in self.events:
+            item = bySql.setdefault(event["sql"], [event["sql"], 0, 0, 0.0])
+            item[1] += 1
+            item[2] += event["rows"]
+            item[3] += event["seconds"]
+        return sorted(bySql.values(), key=lambda item: -item[3])
+
+    def summary(self, file=sys.stderr, width=60):
+        """Print a table of statements, phases and commits"""
+        print("%8s %8s %10s  %s" % ("calls", "rows", "seconds", "statement"), file=file)
+        for sql, calls, rows, seconds in self.statements():
+            if len(sql) > width:
+                sql = sql[: width - 3] + "..."
+            print("%8d %8d %10.4f  %s" % (calls, rows, seconds, sql), file=file)
+        print(
+            "%d statements run by SQLite (including within triggers), "
+            "%d commits taking %.4fs" % (self.executed, self.commits, self.commitSeconds),
+            file=file,
+        )
+        for name, seconds in self.phases.items():
+            print("%10.4fs %s" % (seconds, name), file=file)
+        print("%10.4fs total" % (timer() - self.origin), file=file)
+
+    def write_json(self, filename):
+        """Write the full trace, as JSON"""
+        with open(filename, "w") as f:
+            json.dump(
+                {
+                    "statements": self.events,
+                    "phases": self.phases,
+                    "commits": self.commits,
+                    "commitSeconds": self.commitSeconds,
+                    "executed": self.executed,
+                    "seconds": timer() - self.origin,
+                },
+                f,
+                indent=1,
+            )
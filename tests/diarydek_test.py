@@ -2,9 +2,23 @@ import unittest
 import tempfile
 import logging
 import datetime
-from diarydek.diarydek import Diarydek
+import io
+import json
+from diarydek.diarydek import Diarydek, migrations, noEpoch, to_epoch
+from diarydek import tagquery
+from diarydek.multi import iter_many, labels
+from diarydek.tracing import Profiler
+from diarydek import client
+from diarydek.cli import stdin_rows
+from diarydek import complete
+import diarydek
+from diarydek.render import renderers, write_entries
 import os
+import shutil
+import sqlite3
+import subprocess
 import sys
+import time
 
 logger = logging.getLogger()
 logger.addHandler(logging.StreamHandler(sys.stdout))
@@ -29,6 +43,613 @@ class TestDiary(unittest.TestCase):
         tagNames = [tag[1] for tag in self.diarydek.get_table("tags")]
         self.assertEqual(["test", "bar"], tagNames)
 
+    def test_tag_cache(self):
+        self.diarydek.add_entry("2024-01-01", "one", ["Dan's", "a"])
+        self.diarydek.add_entry("2024-01-02", "two", ["a", "b", "a"])
+        self.assertEqual({"Dan's": 1, "a": 2, "b": 3}, self.diarydek.tag_cache())
+        self.assertEqual(["a", "b"], list(self.diarydek.iter_entries())[1].tags)
+        self.diarydek.rename_tag("a", "c")
+        self.diarydek.add_entry("2024-01-03", "three", ["a"])
+        self.assertEqual({"Dan's": 1, "c": 2, "b": 3, "a": 4}, self.diarydek.tag_cache())
+        # changes made by other connections are noticed
+        other = Diarydek(db=self.database.name)
+        other.add_entry("2024-01-04", "four", ["d"])
+        self.assertEqual(5, self.diarydek.tag_cache()["d"])
+
+    def test_iter_entries(self):
+        self.diarydek.add_entry("2024-01-01 09:00:00", "heard a crow", ["bird"])
+        self.diarydek.add_entry("2024-02-01 09:00:00", "saw a heron", ["bird", "water"])
+        self.diarydek.add_entry("2024-03-01 09:00:00", "swam", ["water"])
+        entries = list(self.diarydek.iter_entries())
+        self.assertEqual(["heard a crow", "saw a heron", "swam"], [e.entry for e in entries])
+        self.assertEqual(["bird", "water"], entries[1].tags)
+        self.assertEqual(
+            ["saw a heron", "swam"],
+            [e.entry for e in self.diarydek.iter_entries(tag="water")],
+        )
+        self.assertEqual(
+            ["swam"],
+            [e.entry for e in self.diarydek.iter_entries(since="2024-02-01 09:00:00")],
+        )
+        self.assertEqual(
+            ["saw a heron"],
+            [e.entry for e in self.diarydek.iter_entries(tag="bird", text="heron")],
+        )
+        self.assertEqual(
+            ["saw a heron"],
+            [
+                e.entry
+                for e in self.diarydek.iter_entries(
+                    since=datetime.datetime(2024, 1, 15), until="2024-03-01"
+                )
+            ],
+        )
+
+    def test_page_entries(self):
+        rows = [("2024-01-01 00:00:%02d" % (i // 2), "entry %d" % i, ["a"]) for i in range(25)]
+        self.diarydek.import_entries(rows)
+        pages = []
+        key = None
+        while True:
+            entries, key = self.diarydek.page_entries(limit=10, after=key, tag="a")
+            pages.append([e.entry for e in entries])
+            if key is None:
+                break
+        self.assertEqual([10, 10, 5], [len(page) for page in pages])
+        self.assertEqual([row[1] for row in rows], sum(pages, []))
+        entries, key = self.diarydek.page_entries(limit=3, reverse=True)
+        self.assertEqual(["entry 24", "entry 23", "entry 22"], [e.entry for e in entries])
+        entries, key = self.diarydek.page_entries(limit=3, reverse=True, after=key)
+        self.assertEqual(["entry 21", "entry 20", "entry 19"], [e.entry for e in entries])
+
+    def test_unreadable_times(self):
+        diary = self.diarydek
+        diary.import_entries([("Jan 3 2024", "late", []), ("2024-01-02", "b", [])])
+        diary.add_entry("2024/01/01", "later", ["t"])
+        diary.add_entry("2024-01-01", "a", ["t"])
+        entries = list(diary.iter_entries())
+        self.assertEqual(["a", "b", "late", "later"], [e.entry for e in entries])
+        self.assertEqual([False, False, True, True], [e.epoch is None for e in entries])
+        for reverse in (False, True):
+            listed = []
+            key = None
+            while True:
+                page, key = diary.page_entries(limit=1, after=key, reverse=reverse)
+                listed.extend(e.entry for e in page)
+                if key is None:
+                    break
+            self.assertEqual([e.entry for e in entries][:: -1 if reverse else 1], listed)
+        newest = diary.iter_entries(reverse=True, limit=2)
+        self.assertEqual(["later", "late"], [e.entry for e in newest])
+        self.assertEqual(["a", "b"], [e.entry for e in diary.iter_entries(since="2023-12-31")])
+        self.assertEqual([("2024-01", 2)], diary.get_period_counts())
+        self.assertEqual(noEpoch, diary.to_columns()["epoch"][-1])
+        merged = iter_many([self.database.name, self.database.name])
+        self.assertEqual(["a", "a", "b", "b"], [e.entry for label, e in merged][:4])
+
+    def test_tag_query(self):
+        self.assertEqual(
+            (
+                "or",
+                ("and", ("tag", "a"), ("tag", "b")),
+                ("and", ("tag", "c"), ("not", ("tag", "d"))),
+            ),
+            tagquery.parse("a AND b OR (c NOT d)"),
+        )
+        self.assertEqual(("and", ("tag", "a"), ("tag", "b")), tagquery.parse(["a", "b"]))
+        for bad in ["", "a AND", "(a", "a)", "OR a"]:
+            with self.assertRaises(ValueError):
+                tagquery.parse(bad)
+        self.assertEqual([0, 3, 64], tagquery.from_bitmap(tagquery.to_bitmap([64, 0, 3])))
+        diary = self.diarydek
+        diary.add_entry("2024-01-01", "one", ["work", "meeting"])
+        diary.add_entry("2024-01-02", "two", ["work", "call", "draft"])
+        diary.add_entry("2024-01-03", "three", ["work", "call"])
+        diary.add_entry("2024-01-04", "four", ["call"])
+        query = "work AND (meeting OR call) NOT draft"
+        self.assertEqual([1, 3], diary.match_tags(query))
+        self.assertEqual(["one", "three"], [e.entry for e in diary.iter_entries(tag=query)])
+        self.assertEqual(["four"], [e.entry for e in diary.iter_entries(tag="NOT work")])
+        # the cached bitmaps follow changes
+        diary.add_entry("2024-01-05", "five", ["work", "meeting"])
+        self.assertEqual([1, 3, 5], diary.match_tags(query))
+        self.assertEqual([], diary.match_tags("nosuchtag OR (work nosuchtag)"))
+
+    def test_text_search(self):
+        self.diarydek.add_entry("2024-01-01 09:00:00", "Heard a crow", [])
+        self.diarydek.add_entry("2024-02-01 09:00:00", "a crowd of herons", [])
+        self.diarydek.add_entry("2024-03-01 09:00:00", "a blue heron", [])
+        self.assertTrue(self.diarydek.has_fts())
+        self.assertEqual(
+            ["Heard a crow", "a crowd of herons"],
+            [e.entry for e in self.diarydek.iter_entries(text="CROW")],
+        )
+        self.assertEqual(
+            ["a blue heron"],
+            [e.entry for e in self.diarydek.iter_entries(match='"blue heron"')],
+        )
+        # a malformed query is reported by error(), not as an SQLite exception
+        self.diarydek.quiet = True
+        with self.assertRaises(SystemExit):
+            list(self.diarydek.iter_entries(match="heron AND"))
+        self.diarydek.quiet = False
+        # the fallback, used when SQLite lacks FTS5
+        self.diarydek.fts = False
+        self.assertEqual(
+            ["a crowd of herons", "a blue heron"],
+            [e.entry for e in self.diarydek.iter_entries(text="heron")],
+        )
+
+    def test_import_entries(self):
+        self.diarydek.add_entry("2024-01-01 09:00:00", "first", ["a"])
+        rows = [("2024-01-0%d" % day, "day %d" % day, ["a", "b"]) for day in range(2, 8)]
+        self.assertEqual(6, self.diarydek.import_entries(rows, batchSize=4))
+        entries = list(self.diarydek.iter_entries(tag="b"))
+        self.assertEqual(6, len(entries))
+        self.assertEqual(["a", "b"], entries[-1].tags)
+        self.assertEqual(["a", "b"], self.diarydek.list_tags())
+        # a tag repeated in a row is linked once
+        self.diarydek.import_entries([("2024-01-08", "repeats", ["a", " a", "b", "a"])])
+        self.assertEqual(["a", "b"], list(self.diarydek.iter_entries())[-1].tags)
+        self.assertEqual([("a", 8), ("b", 7)], self.diarydek.get_tags_with_counts())
+
+        # an import that fails part way through adds nothing
+        def failing():
+            yield ("2024-02-01", "fine", ["c"])
+            yield ("2024-02-02", "", [])
+
+        with self.assertRaises(ValueError):
+            self.diarydek.import_entries(failing(), batchSize=1)
+        self.assertEqual(8, len(self.diarydek.get_table("entries")))
+        self.assertEqual(["a", "b"], self.diarydek.list_tags())
+
+    def test_ingest_entries(self):
+        f = io.StringIO(
+            "made coffee : food morning\n"
+            "\n"
+            '{"time": "2024-01-01 08:00:00", "entry": "woke", "tags": ["morning"]}\n'
+            '{"entry": "no tags"}\n'
+        )
+        self.assertEqual(3, self.diarydek.ingest_entries(stdin_rows(f), batchSize=2))
+        entries = list(self.diarydek.iter_entries())
+        self.assertEqual(["woke", "made coffee", "no tags"], [e.entry for e in entries])
+        self.assertEqual(["food", "morning"], entries[1].tags)
+        # batches before an error are kept
+        f = io.StringIO("one\ntwo\n{not json\n")
+        with self.assertRaises(ValueError):
+            self.diarydek.ingest_entries(stdin_rows(f), batchSize=2)
+        self.assertEqual(5, len(list(self.diarydek.iter_entries())))
+        for line in (
+            '{"entry": 3}',
+            '{"entry": "j", "tags": 7}',
+            '{"entry": "j", "tags": ["a", 1]}',
+            '{"entry": "j", "time": 2024}',
+        ):
+            with self.assertRaisesRegex(ValueError, "line 2 "):
+                list(stdin_rows(io.StringIO("fine\n" + line)))
+        f = io.StringIO('{"entry": "j", "tags": null}\n')
+        self.assertEqual(("j", []), next(stdin_rows(f))[1:])
+
+    def test_write_entries(self):
+        self.diarydek.add_entry("2024-01-01 09:00:00", "tab\there", ["a", "b"])
+        self.diarydek.add_entry("2024-01-02 09:00:00", "untagged", [])
+        outputs = {}
+        for format in renderers:
+            f = io.StringIO()
+            write_entries(self.diarydek.iter_entries(), format, file=f, chunk=1)
+            outputs[format] = f.getvalue()
+        self.assertEqual(
+            "2024-01-01 09:00:00 tab\there : a b \n2024-01-02 09:00:00 untagged\n", outputs["text"]
+        )
+        self.assertEqual("1\t2024-01-01 09:00:00\ttab\\there\ta,b", outputs["tsv"].split("\n")[0])
+        item = json.loads(outputs["jsonl"].split("\n")[1])
+        self.assertEqual([2, "untagged", []], [item["entryId"], item["entry"], item["tags"]])
+        # a reader that has gone away ends the listing quietly
+        listing = subprocess.Popen(
+            [sys.executable, "-m", "diarydek", "--database", self.database.name, "--list"],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        listing.stdout.close()
+        self.assertEqual(b"", listing.stderr.read())
+        self.assertEqual(141, listing.wait())
+        listing.stderr.close()
+
+    def test_write_csv(self):
+        self.diarydek.add_entry("2024-01-01 09:00:00", 'a "quoted" entry', ["a", "b"])
+        self.diarydek.add_entry("2024-01-02 09:00:00", "untagged", [])
+        f = io.StringIO()
+        self.diarydek.write_csv(f)
+        self.assertEqual(
+            '"2024-01-01 09:00:00","a ""quoted"" entry","a,b"\n'
+            '"2024-01-02 09:00:00","untagged",""\n',
+            f.getvalue(),
+        )
+        f = io.StringIO()
+        self.diarydek.write_csv(f, tag="b")
+        self.assertEqual(1, f.getvalue().count("\n"))
+
+    def test_to_columns(self):
+        diary = self.diarydek
+        diary.add_entry("2024-01-02", "second", ["b", "a"])
+        diary.add_entry("2024-01-01", "first", ["a"])
+        diary.add_entry("2024-01-03", "untagged", [])
+        columns = diary.to_columns()
+        self.assertEqual([2, 1, 3], list(columns["entryId"]))
+        self.assertEqual(to_epoch("2024-01-01"), columns["epoch"][0])
+        self.assertEqual([0, 1, 3, 3], list(columns["tagOffsets"]))
+        tags = columns["tags"]
+        self.assertEqual(["a", "b", "a"], [tags[i] for i in columns["tagIds"]])
+        self.assertEqual([1, 3], list(diary.to_columns(tag="b OR NOT a")["entryId"]))
+        try:
+            import numpy
+        except ImportError:
+            return
+        columns = diary.to_columns(numpy=True, since="2024-01-01 12:00")
+        self.assertEqual(numpy.int64, columns["epoch"].dtype)
+        self.assertEqual([1, 3], columns["entryId"].tolist())
+        self.assertEqual([0, 2, 2], columns["tagOffsets"].tolist())
+
+    def test_profiler(self):
+        profiler = Profiler()
+        diary = Diarydek(db=self.database.name, profiler=profiler)
+        diary.add_entry("2024-01-01", "one", ["a", "b"])
+        with profiler.phase("listing"):
+            self.assertEqual(1, len(list(diary.iter_entries(tag="a"))))
+        self.assertEqual(1, profiler.commits)
+        self.assertIn("listing", profiler.phases)
+        rows = dict((item[0][:17], item[2]) for item in profiler.statements())
+        self.assertEqual(1, rows["SELECT e.entryId,"])
+        f = io.StringIO()
+        profiler.summary(f)
+        self.assertIn("1 commits", f.getvalue())
+
+    def test_fast_path(self):
+        # the entry point survives the import of the full command line
+        diarydek.mainer
+        self.assertTrue(callable(diarydek.main))
+        # the common commands avoid building the argument parser
+        script = (
+            "import sys; import diarydek; sys.argv = ['diarydek'] + sys.argv[1:]; "
+            "diarydek.main(); "
+            "print([m for m in ('argparse', 'csv', 'textwrap') if m in sys.modules])"
+        )
+        for args in [["--version"], ["--database", self.database.name, "fast", ":", "a"]]:
+            out = subprocess.run(
+                [sys.executable, "-c", script] + args, capture_output=True, text=True
+            ).stdout
+            self.assertTrue(out.endswith("[]\n"), out)
+        self.assertEqual(["fast"], [e.entry for e in self.diarydek.iter_entries(tag="a")])
+
+    def test_complete_tags(self):
+        diary = self.diarydek
+        diary.add_entry("2024-01-01", "one", ["walk", "work"])
+        diary.add_entry("2024-01-02", "two", ["work", "wine"])
+        diary.add_entry("2024-06-01", "three", ["wine"])
+        now = 1717200000  # 2024-06-01
+        cache = tempfile.mkdtemp()
+        os.environ["XDG_CACHE_HOME"] = cache
+        try:
+            db = self.database.name
+            # ties in count go to the more recently used
+            self.assertEqual(["wine", "work", "walk"], complete.complete_tags(db, "w", now=now))
+            path = complete.cache_path(db)
+            self.assertTrue(os.path.exists(path))
+            diary.delete_entries(ids=[1])
+            self.assertEqual(["wine", "work"], complete.complete_tags(db, "w", now=now))
+            diary.add_entry("2024-01-03", "four", ["walk"])
+            self.assertEqual(["walk"], complete.complete_tags(db, "wa", now=now))
+            # now that the file is up to date, no sqlite3 is needed
+            script = (
+                "import sys; import diarydek; sys.argv = ['diarydek'] + sys.argv[1:]; "
+                "diarydek.main(); print('sqlite3' in sys.modules)"
+            )
+            out = subprocess.run(
+                [sys.executable, "-c", script, "--database", db, "--complete-tags", "wa"],
+                capture_output=True,
+                text=True,
+            ).stdout
+            self.assertEqual("walk\nFalse\n", out)
+            # characters with meanings in URIs
+            odd = os.path.join(cache, "a?b#c%41.db")
+            Diarydek(db=odd, quiet=True).add_entry("2024-01-01", "odd", ["wren"])
+            self.assertEqual(["wren"], complete.complete_tags(odd, "w", now=now))
+        finally:
+            del os.environ["XDG_CACHE_HOME"]
+            shutil.rmtree(cache)
+
+    def test_concurrent_writers(self):
+        sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "benchmarks"))
+        from stress import stress
+
+        directory = tempfile.mkdtemp(prefix="diary")
+        self.assertEqual([], stress(os.path.join(directory, "a.db"), 4, 25))
+        self.assertEqual([], stress(os.path.join(directory, "b.db"), 4, 20, bulk=True))
+        for name in os.listdir(directory):
+            os.remove(os.path.join(directory, name))
+        os.rmdir(directory)
+
+    def test_server(self):
+        runtime = tempfile.mkdtemp(prefix="diary")
+        os.environ["XDG_RUNTIME_DIR"] = runtime
+        self.diarydek.import_entries(
+            [("2023-01-01 %02d:%02d" % divmod(i, 60), "old %d" % i, ["o"]) for i in range(1200)]
+        )
+        try:
+            self.assertIsNone(client.request(self.database.name, {"op": "ping"}))
+            server = subprocess.Popen(
+                [sys.executable, "-m", "diarydek", "--database", self.database.name, "--serve"],
+                stderr=subprocess.DEVNULL,
+            )
+            path = client.socket_path(self.database.name)
+            for _ in range(100):
+                if os.path.exists(path):
+                    break
+                time.sleep(0.05)
+            self.assertEqual(0o700, os.stat(os.path.dirname(path)).st_mode & 0o777)
+            message = {"op": "add", "time": "2024-01-01", "entry": "served", "tags": ["s"]}
+            self.assertEqual(
+                [{"entryId": 1201}], list(client.request(self.database.name, message))
+            )
+            message = {"op": "list", "filters": {"tag": "s"}, "tail": 5}
+            replies = list(client.request(self.database.name, message))
+            self.assertEqual(["served", ["s"]], replies[0]["entry"][2:4])
+            # more than one chunk of replies
+            replies = list(client.request(self.database.name, {"op": "list"}))
+            self.assertEqual(1201, len(replies))
+            self.assertEqual("old 0", replies[0]["entry"][2])
+            with self.assertRaises(client.ServerError):
+                list(client.request(self.database.name, {"op": "bad"}))
+            # a socket in a directory open to others is not trusted
+            os.chmod(os.path.dirname(path), 0o755)
+            self.assertIsNone(client.request(self.database.name, {"op": "ping"}))
+            os.chmod(os.path.dirname(path), 0o700)
+            # the message of Diarydek.error(), not its exit status
+            message = {"op": "add", "time": "2024-01-01", "entry": "", "tags": []}
+            with self.assertRaisesRegex(client.ServerError, "entry"):
+                list(client.request(self.database.name, message))
+            server.terminate()
+            server.wait()
+            self.assertFalse(os.path.exists(path))
+        finally:
+            del os.environ["XDG_RUNTIME_DIR"]
+            os.rmdir(runtime)
+        self.assertEqual(["served"], [e.entry for e in self.diarydek.iter_entries(tag="s")])
+
+    def test_stats(self):
+        diary = self.diarydek
+        diary.add_entry("2024-01-01 09:00:00", "one", ["a", "b"])
+        diary.add_entry("2024-01-02 09:00:00", "two", ["a", "b", "c"])
+        diary.import_entries([("2024-02-01", "three", ["b"])])
+        self.assertEqual([("a", 2), ("b", 3), ("c", 1)], diary.get_tags_with_counts())
+        self.assertEqual([("2024-01", 2), ("2024-02", 1)], diary.get_period_counts())
+        self.assertEqual(3, len(diary.get_period_counts("day")))
+        self.assertEqual(("a", "b", 2), diary.get_tag_pairs()[0])
+        diary.rename_tag("c", "d")
+        diary.cur.execute("DELETE FROM entry_tags WHERE entryId=2;")
+        diary.cur.execute("DELETE FROM entries WHERE entryId=2;")
+        diary.con.commit()
+        self.assertEqual([("a", 1), ("b", 2)], diary.get_tags_with_counts())
+        self.assertEqual([("a", "b", 1)], diary.get_tag_pairs())
+        # as by another program, which does not set the epoch
+        diary.cur.execute("INSERT INTO entries(time, entry) VALUES ('2024-03-01', 'plain');")
+        diary.con.commit()
+        self.assertEqual(("2024-03", 1), diary.get_period_counts()[-1])
+        self.assertEqual(["plain"], [e.entry for e in diary.iter_entries(since="2024-02-15")])
+        # lastUsed only moves forward, so is left out here
+        tables = ["period_counts", "tag_pairs"]
+        counts = "SELECT tagId, count FROM tag_counts ORDER BY tagId;"
+        kept = [diary.cur.execute(counts).fetchall()] + [diary.get_table(t) for t in tables]
+        diary.rebuild_stats()
+        self.assertEqual(
+            kept, [diary.cur.execute(counts).fetchall()] + [diary.get_table(t) for t in tables]
+        )
+
+    def test_duplicates(self):
+        diary = self.diarydek
+        rows = [
+            ("2024-01-01 09:00:00", "one", ["a", "b"]),
+            ("2024-01-01 09:00:00", " one ", ["b", "a"]),
+            ("2024-01-01 09:00:00", "one", ["a"]),
+        ]
+        self.assertEqual(2, diary.import_entries(rows, skipDuplicates=True))
+        self.assertEqual(0, diary.import_entries(rows, skipDuplicates=True))
+        self.assertIsNone(
+            diary.add_entry("2024-01-01 09:00:00", "one", ["b", "a"], skipDuplicate=True)
+        )
+        self.assertEqual(3, diary.import_entries(rows))
+        # hashes follow renamed tags
+        diary.rename_tag("b", "c")
+        self.assertIsNone(
+            diary.add_entry("2024-01-01 09:00:00", "one", ["c", "a"], skipDuplicate=True)
+        )
+        self.assertEqual(3, diary.dedupe())
+        self.assertEqual([1, 3], [e.entryId for e in diary.iter_entries()])
+        self.assertEqual([("a", 2), ("c", 1)], diary.get_tags_with_counts())
+
+    def test_duplicates_unreadable_times(self):
+        diary = self.diarydek
+        rows = [
+            ("2024/01/01", "took pills", ["health"]),
+            ("2024/01/02", "took pills", ["health"]),
+            ("Jan 3 2024", "took pills", ["health"]),
+            ("Jan 3 2024", "took  pills", ["health"]),
+        ]
+        self.assertEqual(3, diary.import_entries(rows, skipDuplicates=True))
+        diary.add_entry("Jan 3 2024", "took pills", ["health"])
+        self.assertEqual(1, diary.dedupe())
+        self.assertEqual(3, len(list(diary.iter_entries())))
+
+    def test_merge_database(self):
+        self.diarydek.add_entry("2024-01-01", "one", ["b", "a"])
+        other = tempfile.NamedTemporaryFile(prefix="diary", delete=False)
+        source = Diarydek(db=other.name)
+        source.add_entry("2024-01-01", "one", ["a", "b"])
+        source.add_entry("2024-01-02", "two", ["a"])
+        source.con.close()
+        self.assertEqual((1, 1), self.diarydek.merge_database(other.name, skipDuplicates=True))
+        entries = list(self.diarydek.iter_entries())
+        self.assertEqual(["one", "two"], [e.entry for e in entries])
+        self.assertEqual([["b", "a"], ["a"]], [e.tags for e in entries])
+        self.assertEqual(entries[0].epoch + 86400 * 10**6, entries[1].epoch)
+        self.assertEqual((2, 0), self.diarydek.merge_database(other.name))
+        self.assertEqual([("a", 4), ("b", 2)], self.diarydek.get_tags_with_counts())
+        self.assertEqual(
+            ["one", "one", "two", "two"], [e.entry for e in self.diarydek.iter_entries()]
+        )
+        with self.assertRaises(ValueError):
+            self.diarydek.merge_database(self.database.name)
+        os.remove(other.name)
+        # a source from before 0.0.26, with two rows for one tag name
+        con = sqlite3.connect(other.name)
+        con.executescript(
+            """
+            CREATE TABLE version(major, minor, subminor);
+            INSERT INTO version VALUES (0, 0, 25);
+            CREATE TABLE tags(tagId integer primary key autoincrement, tag);
+            CREATE TABLE entries(entryId integer primary key autoincrement, time, entry);
+            CREATE TABLE entry_tags(entryTagId integer primary key autoincrement, entryId, tagId);
+            INSERT INTO tags(tag) VALUES ('c'), ('c');
+            INSERT INTO entries(time, entry) VALUES ('2024-01-03', 'three');
+            INSERT INTO entry_tags(entryId, tagId) VALUES (1, 1), (1, 2);
+            """
+        )
+        con.close()
+        self.assertEqual((1, 0), self.diarydek.merge_database(other.name))
+        self.assertEqual(["c"], list(self.diarydek.iter_entries(tag="c"))[0].tags)
+        self.assertEqual(("c", 1), self.diarydek.get_tags_with_counts()[-1])
+        os.remove(other.name)
+
+    def test_bulk_operations(self):
+        diary = self.diarydek
+        for day in range(1, 7):
+            diary.add_entry("2024-01-0%d" % day, "day %d" % day, ["odd" if day % 2 else "even"])
+        diary.delete_by_id(1)
+        # links go with their entries
+        self.assertEqual([("even", 3), ("odd", 2)], diary.get_tags_with_counts())
+        self.assertEqual(5, len(diary.get_table("entry_tags")))
+        self.assertEqual(2, diary.delete_entries(first=2, last=3))
+        self.assertEqual(2, diary.tag_entries("late", since="2024-01-04"))
+        self.assertEqual(1, diary.tag_entries("late", ids=[4, 5]))
+        self.assertEqual(1, diary.untag_entries(" late ", tag="odd"))
+        diary.quiet = True
+        for name in ("", "  ", "a,b"):
+            with self.assertRaises(SystemExit):
+                diary.tag_entries(name, ids=[4])
+            with self.assertRaises(SystemExit):
+                diary.untag_entries(name, ids=[4])
+        diary.quiet = False
+        diary.merge_tags("even", "late")
+        self.assertEqual([["late"], ["odd"], ["late"]], [e.tags for e in diary.iter_entries()])
+        self.assertEqual(1, diary.delete_entries(tag="odd"))
+        with self.assertRaises(ValueError):
+            diary.delete_entries()
+        self.assertEqual((0, 1), diary.vacuum())
+        self.assertEqual([("late", 2)], diary.get_tags_with_counts())
+
+    def test_changes(self):
+        diary = self.diarydek
+        diary.add_entry("2024-01-01", "one", ["a"])
+        diary.add_entry("2024-01-02", "two", ["a", "b"])
+        other = tempfile.NamedTemporaryFile(prefix="diary", delete=False)
+        copy = Diarydek(db=other.name)
+        changes = list(diary.iter_changes())
+        self.assertEqual(["add", "add", "end"], [c["op"] for c in changes])
+        self.assertEqual(["a", "b"], changes[1]["tags"])
+        self.assertEqual(2, copy.apply_changes(changes))
+        self.assertEqual(0, copy.apply_changes(changes))
+        since = changes[-1]["seq"]
+        diary.add_entry("2024-01-03", "three", [])
+        diary.add_entry("2024-01-04", "four", [])
+        diary.cur.execute("DELETE FROM entries WHERE entry = 'three';")
+        diary.cur.execute("DELETE FROM entry_tags WHERE entryId = 2 AND tagId = 2;")
+        diary.cur.execute("DELETE FROM entries WHERE entryId = 1;")
+        diary.con.commit()
+        diary.rename_tag("a", "c")
+        changes = list(diary.iter_changes(since))
+        # "three" was added and deleted, so is not mentioned
+        self.assertEqual(
+            ["add", "untag", "delete", "rename", "end"], [c["op"] for c in changes]
+        )
+        self.assertEqual(4, copy.apply_changes(changes))
+        entries = lambda d: [(e.time, e.entry, e.tags) for e in d.iter_entries()]
+        self.assertEqual(entries(diary), entries(copy))
+        self.assertEqual([changes[-1]], list(diary.iter_changes(changes[-1]["seq"])))
+        # reading the journal leaves the caller's transaction open
+        diary.cur.execute("INSERT INTO entries(time, entry) VALUES ('2024-01-05', 'five');")
+        list(diary.iter_changes(since))
+        diary.con.rollback()
+        self.assertNotIn("five", [e.entry for e in diary.iter_entries()])
+        copy.con.close()
+        os.remove(other.name)
+
+    def test_iter_many(self):
+        self.diarydek.add_entry("2024-01-01", "one", ["a"])
+        self.diarydek.add_entry("2024-01-03", "three", [])
+        other = tempfile.NamedTemporaryFile(prefix="other", suffix=".db", delete=False)
+        source = Diarydek(db=other.name)
+        source.import_entries([("2024-01-02", "two", ["a"]), ("2024-01-04", "four", [])])
+        source.con.close()
+        databases = [self.database.name, other.name]
+        label = os.path.basename(other.name)[:-3]
+        merged = list(iter_many(databases, chunk=1))
+        self.assertEqual(["one", "two", "three", "four"], [e.entry for _, e in merged])
+        self.assertEqual(label, merged[1][0])
+        self.assertEqual(
+            ["four", "three"], [e.entry for _, e in iter_many(databases, reverse=True, limit=2)]
+        )
+        self.assertEqual(["one", "two"], [e.entry for _, e in iter_many(databases, tag="a")])
+        with self.assertRaises(ValueError):
+            list(iter_many(databases + ["/nonexistent.db"]))
+        os.remove(other.name)
+        # diaries of the same name are told apart by their directories
+        self.assertEqual(
+            ["work/diary", "home/diary", "notes"],
+            labels(["/u/work/diary.db", "/u/home/diary.db", "/u/notes.db"]),
+        )
+
+    def test_migrate(self):
+        # build a database as older versions of diarydek did, with a
+        # duplicated tag name
+        old = tempfile.NamedTemporaryFile(prefix="diary", delete=False)
+        con = sqlite3.connect(old.name)
+        con.executescript(
+            """
+            CREATE TABLE version(major, minor, subminor);
+            INSERT INTO version VALUES (0, 0, 25);
+            CREATE TABLE tags(tagId integer primary key autoincrement, tag);
+            CREATE TABLE entries(entryId integer primary key autoincrement, time, entry);
+            CREATE TABLE entry_tags(entryTagId integer primary key autoincrement, entryId, tagId);
+            INSERT INTO tags(tag) VALUES ('a'), ('b'), ('a');
+            INSERT INTO entries(time, entry) VALUES ('2024-01-01', 'one'), ('someday', 'two');
+            INSERT INTO entry_tags(entryId, tagId) VALUES (1, 1), (1, 3);
+            INSERT INTO entry_tags(entryId, tagId) VALUES (3, 2); -- orphaned
+            """
+        )
+        con.close()
+        diary = Diarydek(db=old.name)
+        self.assertEqual(migrations[-1][0], tuple(diary.dbversion))
+        self.assertEqual([(1, "a"), (2, "b")], diary.get_table("tags"))
+        self.assertEqual([1], [row[2] for row in diary.get_table("entry_tags")])
+        self.assertEqual([("a", 1)], diary.get_tags_with_counts())
+        self.assertEqual(["a"], list(diary.iter_entries())[0].tags)
+        self.assertEqual(
+            1704067200000000, next(diary.iter_entries(since="2023-12-31")).epoch
+        )
+        self.assertIsNone(list(diary.iter_entries())[-1].epoch)
+        indexes = [
+            row[0]
+            for row in diary.cur.execute(
+                "SELECT name FROM sqlite_master WHERE type='index';"
+            )
+        ]
+        for index in ["tags_tag", "entries_time", "entry_tags_entryId"]:
+            self.assertIn(index, indexes)
+        # dropping the repeated link is not a change to send to other diaries
+        self.assertNotIn("untag", [change["op"] for change in diary.iter_changes()])
+        diary.con.close()
+        os.remove(old.name)
+
     def tearDown(self):
         logger.debug("Removing temporary database file.")
         os.remove(self.database.name)